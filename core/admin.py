@@ -1,5 +1,11 @@
 # core/admin.py
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms import ModelChoiceField
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from .models import (
     Patient,
     Doctor,
@@ -8,15 +14,258 @@ from .models import (
     LabResult,
     Appointment,
     Message,
-    HealthMetric
+    HealthMetric,
+    AccessLog,
+    ImportJob,
+    ArchiveSegment,
+    AlertRule,
+    MetricAlert
 )
+from .sharding import is_sharded, shard_aliases
 
-# Register all models to make them accessible in the admin panel
-admin.site.register(Patient)
-admin.site.register(Doctor)
-admin.site.register(EMR)
-admin.site.register(Prescription)
-admin.site.register(LabResult)
-admin.site.register(Appointment)
-admin.site.register(Message)
-admin.site.register(HealthMetric)
\ No newline at end of file
+
+def estimated_row_count(model, using):
+    """
+    Row count from the table statistics, or None where the backend has none.
+    It's approximate but costs the same at any table size.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Skips the COUNT(*) of unfiltered changelists on big tables and uses the
+    table statistics instead. Filtered lists are still counted exactly, and
+    so is the list once a page past the estimate's accuracy is requested:
+    the last page, or one that comes back empty.
+    """
+    exact_count_below = 10000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_below:
+                self.estimated = True
+                return estimate
+        return super().count
+
+    def page(self, number):
+        page = super().page(number)
+        if self.estimated and (page.number == self.num_pages or not page.object_list):
+            # Reaching the end scans the table for the OFFSET anyway, so count it exactly
+            self.estimated = False
+            self.__dict__['count'] = self.object_list.count()
+            for name in ['num_pages', 'page_range']:
+                self.__dict__.pop(name, None)
+            page = super().page(min(page.number, self.num_pages))
+        return page
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Base admin for tables that grow to millions of rows."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # Avoids a second, unfiltered COUNT(*)
+    list_per_page = 50
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Picks the shard whose rows a ShardedModelAdmin changelist shows."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def queryset(self, request, queryset):
+        return queryset # ShardedModelAdmin.get_queryset() already reads from the shard
+
+    def choices(self, changelist):
+        current = self.value() if self.value() in shard_aliases() else shard_aliases()[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == current,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedModelAdmin(LargeTableAdmin):
+    """
+    Admin of a model spread over PATIENT_SHARDS. The changelist lists one
+    shard at a time, picked with the shard filter (the first one by
+    default); change and delete views find the row on whichever shard holds
+    it. The shards have no patient or doctor tables, so those relations are
+    prefetched from 'default' rather than joined.
+    """
+    list_select_related = () # False would select_related() the list_display relations
+    list_prefetch_related = ()
+
+    def get_shard(self, request):
+        alias = request.GET.get(ShardListFilter.parameter_name)
+        if alias is None and '_changelist_filters' in request.GET:
+            alias = QueryDict(request.GET['_changelist_filters']).get(ShardListFilter.parameter_name)
+        return alias if alias in shard_aliases() else shard_aliases()[0]
+
+    def get_list_filter(self, request):
+        return (ShardListFilter,) + tuple(super().get_list_filter(request))
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).using(self.get_shard(request))
+        return queryset.prefetch_related(*self.list_prefetch_related)
+
+    def get_object(self, request, object_id, from_field=None):
+        queryset = super().get_queryset(request)
+        field = self.model._meta.pk if from_field is None else self.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        # Ids are unique across shards, so the row is the one found first
+        current = self.get_shard(request)
+        for alias in [current] + [alias for alias in shard_aliases() if alias != current]:
+            obj = queryset.using(alias).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        form = super().get_form(request, obj, change, **kwargs)
+        # Sharded rows only relate to rows on their own shard, e.g. a LabResult to its EMR
+        alias = obj._state.db if obj is not None else self.get_shard(request)
+        for field in form.base_fields.values():
+            if isinstance(field, ModelChoiceField) and is_sharded(field.queryset.model):
+                field.queryset = field.queryset.using(alias)
+                widget = getattr(field.widget, 'widget', field.widget)
+                if hasattr(widget, 'db'):
+                    widget.db = alias
+        return form
+
+
+@admin.register(Patient)
+class PatientAdmin(LargeTableAdmin):
+    list_display = ('patient_id', 'full_name', 'user', 'phone')
+    list_select_related = ('user',)
+    search_fields = ('=patient_id', '^full_name')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Doctor)
+class DoctorAdmin(LargeTableAdmin):
+    list_display = ('doctor_id', 'full_name', 'specialization', 'user')
+    list_select_related = ('user',)
+    search_fields = ('=doctor_id', '^full_name')
+    raw_id_fields = ('user',)
+
+
+@admin.register(EMR)
+class EMRAdmin(ShardedModelAdmin):
+    list_display = ('id', 'patient', 'doctor', 'created_at', 'updated_at')
+    list_prefetch_related = ('patient', 'doctor')
+    search_fields = ('=patient__patient_id', '=doctor__doctor_id')
+    autocomplete_fields = ('patient', 'doctor')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(Prescription)
+class PrescriptionAdmin(ShardedModelAdmin):
+    list_display = ('medication_name', 'dosage', 'patient', 'doctor', 'created_at')
+    list_prefetch_related = ('patient', 'doctor')
+    search_fields = ('=patient__patient_id', '=doctor__doctor_id', '^medication_name')
+    autocomplete_fields = ('patient', 'doctor')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(LabResult)
+class LabResultAdmin(ShardedModelAdmin):
+    list_display = ('test_name', 'emr', 'test_date')
+    list_prefetch_related = ('emr__patient',) # EMR.__str__ goes through emr.patient
+    search_fields = ('=emr__patient__patient_id',)
+    raw_id_fields = ('emr',)
+    date_hierarchy = 'test_date'
+
+
+@admin.register(Appointment)
+class AppointmentAdmin(ShardedModelAdmin):
+    list_display = ('id', 'patient', 'doctor', 'appointment_datetime', 'status')
+    list_prefetch_related = ('patient', 'doctor')
+    list_filter = ('status',)
+    search_fields = ('=patient__patient_id', '=doctor__doctor_id')
+    autocomplete_fields = ('patient', 'doctor')
+    date_hierarchy = 'appointment_datetime'
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ('id', 'conversation_number', 'sender', 'sent_at')
+    list_select_related = ('sender',)
+    search_fields = ('=conversation__id', '=sender__username')
+    raw_id_fields = ('conversation', 'sender')
+    date_hierarchy = 'sent_at'
+
+    @admin.display(description='Conversation', ordering='conversation')
+    def conversation_number(self, obj):
+        # Conversation.__str__ lists its participants, which is a query per row
+        return obj.conversation_id
+
+
+@admin.register(HealthMetric)
+class HealthMetricAdmin(ShardedModelAdmin):
+    list_display = ('metric_type', 'value', 'unit', 'patient', 'recorded_at')
+    list_prefetch_related = ('patient',)
+    search_fields = ('=patient__patient_id',)
+    autocomplete_fields = ('patient',)
+    date_hierarchy = 'recorded_at'
+
+
+@admin.register(AccessLog)
+class AccessLogAdmin(LargeTableAdmin):
+    list_display = ('accessed_at', 'action', 'resource_type', 'object_id', 'patient_id', 'user')
+    list_select_related = ('user',)
+    search_fields = ('=patient_id', '=user__username')
+    raw_id_fields = ('user',)
+    date_hierarchy = 'accessed_at'
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_line', 'created_rows', 'error_rows', 'started_at', 'completed_at')
+
+
+@admin.register(ArchiveSegment)
+class ArchiveSegmentAdmin(LargeTableAdmin):
+    list_display = ('kind', 'key', 'first_at', 'last_at', 'row_count')
+    search_fields = ('=key',)
+
+
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ('metric_type', 'statistic', 'window', 'operator', 'threshold', 'patient', 'is_active')
+    list_select_related = ('patient',)
+    list_filter = ('statistic', 'is_active')
+    search_fields = ('=metric_type', '=patient__patient_id')
+    autocomplete_fields = ('patient', 'created_by')
+
+
+@admin.register(MetricAlert)
+class MetricAlertAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'patient', 'doctor', 'metric_type', 'observed_value', 'acknowledged_at')
+    list_select_related = ('patient', 'doctor')
+    search_fields = ('=patient__patient_id', '=doctor__doctor_id')
+    raw_id_fields = ('rule', 'patient', 'doctor')
+    date_hierarchy = 'created_at'
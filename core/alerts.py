@@ -0,0 +1,98 @@
+# core/alerts.py
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ALERT_MAX_WINDOW, AlertRule, Appointment, EMR, MetricAlert, MetricSeriesState
+from .sharding import for_patient
+
+
+def rolling_statistic(rule, readings):
+    """The rule's statistic over its window of [timestamp, value] readings, or None if there are too few."""
+    window = readings[-rule.window:]
+    if len(window) < rule.window:
+        return None
+    values = [value for _, value in window]
+    if rule.statistic == 'value':
+        return values[-1]
+    if rule.statistic == 'mean':
+        return sum(values) / len(values)
+    if rule.statistic == 'min':
+        return min(values)
+    if rule.statistic == 'max':
+        return max(values)
+    if rule.statistic == 'rate':
+        hours = (window[-1][0] - window[0][0]) / 3600
+        return (values[-1] - values[0]) / hours if hours > 0 else None
+    raise ValueError(f"Unknown statistic '{rule.statistic}'.")
+
+
+def treating_doctor_id(patient_id):
+    """The doctor on the patient's latest EMR, else on their latest approved appointment."""
+    doctor_id = (
+        for_patient(EMR.objects.filter(patient_id=patient_id, doctor__isnull=False), patient_id)
+        .order_by('-created_at').values_list('doctor_id', flat=True).first()
+    )
+    if doctor_id is None:
+        doctor_id = (
+            for_patient(Appointment.objects.filter(patient_id=patient_id, status='Approved'), patient_id)
+            .order_by('-appointment_datetime').values_list('doctor_id', flat=True).first()
+        )
+    return doctor_id
+
+
+def evaluate_reading(metric):
+    """
+    Updates the series state with a new HealthMetric and raises a MetricAlert
+    for every rule that has just crossed its threshold. The work per reading
+    is bounded by ALERT_MAX_WINDOW, however long the patient's history is.
+    Returns the new alerts.
+    """
+    try:
+        value = float(metric.value)
+    except (TypeError, ValueError):
+        return [] # Non-numeric readings can't be thresholded
+    rules = list(AlertRule.objects.filter(
+        Q(patient__isnull=True) | Q(patient_id=metric.patient_id),
+        metric_type=metric.metric_type,
+        is_active=True,
+    ))
+
+    with transaction.atomic():
+        state, _ = MetricSeriesState.objects.select_for_update().get_or_create(
+            patient_id=metric.patient_id, metric_type=metric.metric_type,
+        )
+        # Every reading goes into the window, so a rule added later starts from recent ones
+        readings = (state.readings + [[metric.recorded_at.timestamp(), value]])[-ALERT_MAX_WINDOW:]
+        # Rules since deactivated are forgotten, so they alert afresh once re-enabled
+        breached = set(state.breached_rules) & {rule.id for rule in rules}
+        fired = []
+        for rule in rules:
+            observed = rolling_statistic(rule, readings)
+            if observed is None:
+                continue
+            crossed = observed > rule.threshold if rule.operator == 'gt' else observed < rule.threshold
+            # Alert once when the threshold is crossed, not on every reading past it
+            if crossed and rule.id not in breached:
+                breached.add(rule.id)
+                fired.append((rule, observed))
+            elif not crossed:
+                breached.discard(rule.id)
+        state.readings = readings
+        state.breached_rules = sorted(breached)
+        state.save(update_fields=['readings', 'breached_rules'])
+
+        if not fired:
+            return []
+        doctor_id = treating_doctor_id(metric.patient_id)
+        return MetricAlert.objects.bulk_create([
+            MetricAlert(
+                rule=rule,
+                patient_id=metric.patient_id,
+                doctor_id=doctor_id or rule.created_by_id, # A patient with no doctor yet alerts the rule's author
+                metric_type=metric.metric_type,
+                observed_value=observed,
+                message=f"{rule.get_statistic_display()} of {metric.metric_type} is {observed:g} "
+                        f"({rule.get_operator_display().lower()} {rule.threshold:g}).",
+            )
+            for rule, observed in fired
+        ])
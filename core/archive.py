@@ -0,0 +1,175 @@
+# core/archive.py
+import gzip
+import json
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .models import ArchiveSegment, HealthMetric, Message
+from .serializers import HealthMetricSerializer, MessageSerializer
+from .sharding import aliases_for, is_sharded, shard_for
+
+ARCHIVE_DEFAULTS = {
+    'DIR': 'archive',
+    'OLDER_THAN_DAYS': 180,
+    'SEGMENT_ROWS': 5000,
+}
+
+# kind -> (model, key field, time field, serializer whose output is archived, relations it reads)
+ARCHIVE_KINDS = {
+    'message': (Message, 'conversation_id', 'sent_at', MessageSerializer, ['sender']),
+    'healthmetric': (HealthMetric, 'patient_id', 'recorded_at', HealthMetricSerializer, ['patient']),
+}
+
+
+def archive_settings():
+    """Returns ARCHIVE from settings merged over the defaults."""
+    return {**ARCHIVE_DEFAULTS, **getattr(settings, 'ARCHIVE', {})}
+
+
+def archive_dir():
+    return Path(settings.BASE_DIR) / archive_settings()['DIR']
+
+
+def _write_segment_file(kind, key, rows):
+    """
+    Stores serialized rows column by column (one list per field) in a gzipped
+    JSON file and returns its path relative to the archive directory.
+    """
+    relative = Path(kind) / str(key) / f"{uuid.uuid4().hex}.json.gz"
+    path = archive_dir() / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    columns = list(rows[0].keys())
+    payload = {'columns': columns, 'data': {column: [row[column] for row in rows] for column in columns}}
+    temporary = path.with_suffix('.tmp')
+    with gzip.open(temporary, 'wt', encoding='utf-8') as output:
+        json.dump(payload, output, separators=(',', ':'))
+    os.replace(temporary, path)
+    return relative.as_posix()
+
+
+@lru_cache(maxsize=64)
+def _read_segment_file(relative_path):
+    # Segment files never change once written, so decoded ones can be cached
+    with gzip.open(archive_dir() / relative_path, 'rt', encoding='utf-8') as source:
+        payload = json.load(source)
+    columns, data = payload['columns'], payload['data']
+    return [dict(zip(columns, values)) for values in zip(*(data[column] for column in columns))]
+
+
+def archive_key(kind, key, cutoff, segment_rows):
+    """Moves the rows of one conversation / patient older than `cutoff` into segments."""
+    model, key_field, time_field, serializer_class, related = ARCHIVE_KINDS[kind]
+    using = shard_for(key) if is_sharded(model) else 'default'
+    archived = 0
+    while True:
+        rows = list(
+            model.objects.using(using).filter(**{key_field: key, f'{time_field}__lt': cutoff})
+            .prefetch_related(*related)
+            .order_by(time_field, 'pk')[:segment_rows]
+        )
+        if not rows:
+            return archived
+        data = serializer_class(rows, many=True).data
+        path = _write_segment_file(kind, key, data)
+        # The segment row commits first: a failure in between leaves rows
+        # both hot and archived rather than lost
+        with transaction.atomic(using=using), transaction.atomic():
+            ArchiveSegment.objects.create(
+                kind=kind,
+                key=str(key),
+                first_at=getattr(rows[0], time_field),
+                last_at=getattr(rows[-1], time_field),
+                row_count=len(rows),
+                path=path,
+            )
+            model.objects.using(using).filter(pk__in=[row.pk for row in rows]).delete()
+        archived += len(rows)
+
+
+def archive_older_than(kind, cutoff, segment_rows=None):
+    """Archives every row of `kind` older than `cutoff`; returns the number of rows moved."""
+    model, key_field, time_field, _, _ = ARCHIVE_KINDS[kind]
+    segment_rows = segment_rows or archive_settings()['SEGMENT_ROWS']
+    keys = []
+    for alias in aliases_for(model):
+        keys += (
+            model.objects.using(alias).filter(**{f'{time_field}__lt': cutoff})
+            .order_by().values_list(key_field, flat=True).distinct()
+        )
+    return sum(archive_key(kind, key, cutoff, segment_rows) for key in keys)
+
+
+def archived_rows(kind, keys, before, limit):
+    """
+    The newest `limit` archived rows older than `before`, oldest first.
+    `keys` limits the search to those conversations / patients (None = all).
+    Segments are read newest first and only until `limit` rows are found.
+    """
+    _, _, time_field, _, _ = ARCHIVE_KINDS[kind]
+    segments = ArchiveSegment.objects.filter(kind=kind, first_at__lt=before).order_by('-last_at')
+    if keys is not None:
+        segments = segments.filter(key__in=[str(key) for key in keys])
+
+    found = []
+    for segment in segments.iterator():
+        if len(found) >= limit and segment.last_at < found[-1][0]:
+            break
+        for row in _read_segment_file(segment.path):
+            timestamp = parse_datetime(row[time_field])
+            if timestamp < before:
+                found.append((timestamp, row))
+        found.sort(key=lambda item: item[0], reverse=True)
+        del found[limit:]
+    return [row for _, row in reversed(found)]
+
+
+class ArchiveScrollbackMixin:
+    """
+    Lets a list view page backwards with ?before=<ISO datetime>&limit=N.
+    Hot rows come from the view's queryset; when they run out, the page is
+    filled from archived segments, so clients never see the archive boundary.
+    Set `archive_kind` and override get_archive_keys(); by default no
+    archives are read.
+    """
+    archive_kind = None
+    default_scrollback_limit = 50
+    max_scrollback_limit = 500
+
+    def get_archive_keys(self):
+        """Conversation ids / patient_ids the user may read archives of (None = all)."""
+        return []
+
+    def list(self, request, *args, **kwargs):
+        if 'before' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        before = parse_datetime(request.query_params['before'])
+        if before is None:
+            raise ValidationError("'before' must be an ISO 8601 datetime.")
+        if timezone.is_naive(before):
+            before = timezone.make_aware(before)
+        try:
+            limit = int(request.query_params.get('limit', self.default_scrollback_limit))
+        except ValueError:
+            raise ValidationError("'limit' must be an integer.")
+        limit = max(1, min(limit, self.max_scrollback_limit))
+
+        _, _, time_field, _, _ = ARCHIVE_KINDS[self.archive_kind]
+        hot = list(
+            self.filter_queryset(self.get_queryset())
+            .filter(**{f'{time_field}__lt': before})
+            .order_by(f'-{time_field}', '-pk')[:limit]
+        )
+        rows = list(reversed(self.get_serializer(hot, many=True).data))
+        keys = self.get_archive_keys()
+        if len(hot) < limit and keys != []:
+            rows = archived_rows(self.archive_kind, keys, before, limit - len(hot)) + rows
+        return Response(rows)
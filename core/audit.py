@@ -0,0 +1,293 @@
+# core/audit.py
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import permissions
+
+try:
+    import fcntl
+except ImportError: # Windows: spools of crashed processes are not replayed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DEFAULTS = {
+    'ENABLED': True,
+    'SPOOL_DIR': 'audit_spool',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_QUEUE': 10000,
+}
+
+
+def audit_settings():
+    """Returns AUDIT_LOG from settings merged over the defaults."""
+    return {**AUDIT_DEFAULTS, **getattr(settings, 'AUDIT_LOG', {})}
+
+
+class AuditWriter:
+    """
+    Write-behind buffer for AccessLog rows.
+
+    record() appends the event to a per-process spool file and puts it on a
+    bounded queue; a daemon thread drains the queue and writes the events
+    with bulk_create. The spool is truncated only once everything in it is
+    in the database, so after a crash the next process to start replays it.
+    Events that could not be queued or written stay in the spool and are
+    written from it once the queue is empty again. Replays are idempotent
+    because event_id is unique.
+    """
+    def __init__(self, spool_dir, batch_size, flush_interval, max_queue):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._spool = None
+        self._spool_dirty = False # The spool holds events that are neither queued nor written
+        self._orphans_pending = fcntl is not None # Spools of crashed processes may be waiting
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def record(self, event):
+        self.record_many([event])
+
+    def record_many(self, events):
+        """Spools `events` with a single write and queues them."""
+        if not events:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._spool.write(''.join(json.dumps(event) + '\n' for event in events))
+            self._spool.flush()
+            try:
+                for event in events:
+                    self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                # The writer is behind: the rest is written from the spool once it catches up
+                self._spool_dirty = True
+        logger.warning("Audit queue is full, leaving access events in the spool")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=self.flush_interval + 10)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            path = self.spool_dir / f"spool-{os.getpid()}.jsonl"
+            if path.exists() and path.stat().st_size:
+                # Left behind by an earlier process with the same pid
+                path.rename(self.spool_dir / f"spool-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+            self._spool = open(path, 'a+', encoding='utf-8')
+            if fcntl is not None:
+                fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            if self._orphans_pending:
+                self._replay_orphaned_spools()
+            batch = self._take_batch()
+            if batch:
+                close_old_connections()
+                try:
+                    self._write(batch)
+                except Exception:
+                    logger.exception("Failed to write %d audit events", len(batch))
+                    with self._lock:
+                        self._spool_dirty = True
+            if self._spool_dirty and self._queue.empty():
+                self._drain_spool()
+            with self._lock:
+                # Only this thread takes events off the queue, so once it is
+                # empty everything spooled is in the database
+                if not self._spool_dirty and self._queue.empty() and self._spool.tell():
+                    self._spool.seek(0)
+                    self._spool.truncate()
+
+    def _drain_spool(self):
+        """Writes everything in the spool again, e.g. after a failed batch."""
+        with self._lock:
+            events = self._parse_spool(self._spool)
+            self._spool_dirty = False
+        close_old_connections()
+        try:
+            for start in range(0, len(events), self.batch_size):
+                self._write(events[start:start + self.batch_size])
+        except Exception:
+            logger.exception("Failed to write %d spooled audit events", len(events))
+            with self._lock:
+                self._spool_dirty = True
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, events):
+        from .models import AccessLog
+        rows = [
+            AccessLog(**{**event, 'accessed_at': parse_datetime(event['accessed_at'])})
+            for event in events
+        ]
+        AccessLog.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def _parse_spool(self, spool):
+        """
+        The events in an open spool file. Lines that are not events, e.g. the
+        torn last line of a process that crashed mid-write, are moved to a
+        .rejected file next to the spool rather than failing every replay.
+        """
+        spool.seek(0)
+        events, rejected = [], []
+        for line in spool.read().splitlines():
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                event = None
+            if isinstance(event, dict):
+                events.append(event)
+            else:
+                rejected.append(line + '\n')
+        if rejected:
+            path = Path(spool.name)
+            logger.warning("Moving %d unreadable line(s) of audit spool %s aside", len(rejected), path.name)
+            with open(path.with_suffix('.rejected'), 'a', encoding='utf-8') as quarantine:
+                quarantine.write(''.join(rejected))
+            spool.seek(0)
+            spool.truncate()
+            spool.write(''.join(json.dumps(event) + '\n' for event in events))
+            spool.flush()
+        return events
+
+    def _replay_orphaned_spools(self):
+        """
+        Writes and removes the spools of crashed processes. If that fails the
+        spool is left in place and the loop in _run() tries again.
+        """
+        try:
+            for path in self.spool_dir.glob('spool-*.jsonl'):
+                if path.name == Path(self._spool.name).name:
+                    continue
+                with open(path, 'r+', encoding='utf-8') as spool:
+                    try:
+                        fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue # Still owned by a live process
+                    events = self._parse_spool(spool)
+                    close_old_connections()
+                    for start in range(0, len(events), self.batch_size):
+                        self._write(events[start:start + self.batch_size])
+                path.unlink()
+        except Exception:
+            logger.exception("Failed to replay orphaned audit spools")
+        else:
+            self._orphans_pending = False
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = audit_settings()
+                _writer = AuditWriter(
+                    Path(settings.BASE_DIR) / config['SPOOL_DIR'],
+                    config['BATCH_SIZE'], config['FLUSH_INTERVAL'], config['MAX_QUEUE'],
+                )
+    return _writer
+
+
+def record_access(request, resource_type, objects, action):
+    """Buffers one AccessLog event per object read by the request."""
+    if not audit_settings()['ENABLED']:
+        return
+    get_writer().record_many([
+        access_event(request, resource_type, obj.pk, obj.patient_id, action) for obj in objects
+    ])
+
+
+def record_event(request, resource_type, object_id, patient_id, action):
+    """Buffers a single AccessLog event."""
+    if not audit_settings()['ENABLED']:
+        return
+    get_writer().record(access_event(request, resource_type, object_id, patient_id, action))
+
+
+def access_event(request, resource_type, object_id, patient_id, action):
+    return {
+        'event_id': str(uuid.uuid4()),
+        'user_id': request.user.pk if request.user.is_authenticated else None,
+        'resource_type': resource_type,
+        'object_id': str(object_id),
+        'patient_id': patient_id or '',
+        'action': action,
+        'path': request.path[:255],
+        'accessed_at': timezone.now().isoformat(),
+    }
+
+
+def query_access_log(start, end, user_id=None, patient_id=None, resource_type=None):
+    """
+    Access events in [start, end), newest first. Served by the accessed_at
+    index, or the (patient_id, accessed_at) / (user, accessed_at) ones.
+    """
+    from .models import AccessLog
+    queryset = AccessLog.objects.filter(accessed_at__gte=start, accessed_at__lt=end)
+    if user_id is not None:
+        queryset = queryset.filter(user_id=user_id)
+    if patient_id is not None:
+        queryset = queryset.filter(patient_id=patient_id)
+    if resource_type is not None:
+        queryset = queryset.filter(resource_type=resource_type)
+    return queryset.order_by('-accessed_at')
+
+
+class AuditedReadMixin:
+    """
+    Logs every object a viewset serializes for a read request.
+    Set `audit_resource` on the viewset.
+    """
+    audit_resource = None
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method in permissions.SAFE_METHODS:
+            if kwargs.get('many'):
+                objects = list(args[0])
+                args = (objects,) + args[1:]
+                record_access(self.request, self.audit_resource, objects, 'list')
+            else:
+                record_access(self.request, self.audit_resource, [args[0]], 'retrieve')
+        return super().get_serializer(*args, **kwargs)
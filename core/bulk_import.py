@@ -0,0 +1,272 @@
+# core/bulk_import.py
+import csv
+import json
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Patient, Doctor, EMR, Prescription, ImportRef
+from .sharding import assign_ids, atomic_on, shard_aliases, shard_for
+from .utils import generate_custom_id
+
+PATIENT_FIELDS = [
+    'full_name', 'date_of_birth', 'gender', 'phone', 'address',
+    'allergies', 'existing_conditions', 'medications',
+]
+CLINICAL_FIELDS = {
+    'emr': (EMR, ['diagnosis', 'treatment_plan']),
+    'prescription': (Prescription, ['medication_name', 'dosage', 'instructions']),
+}
+
+
+class RowError(Exception):
+    pass
+
+
+def read_records(path, fmt):
+    """
+    Yields (line, record, error) for each input record. CSV files hold
+    patient rows; NDJSON lines carry a 'type' of patient, emr or prescription.
+    """
+    with open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            for line, row in enumerate(csv.DictReader(source), start=1):
+                yield line, {'type': 'patient', **row}, None
+            return
+        for line, text in enumerate(source, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as exc:
+                yield line, None, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(record, dict):
+                yield line, None, "Expected a JSON object."
+                continue
+            not_text = sorted(key for key, value in record.items() if not isinstance(value, (str, type(None))))
+            if not_text:
+                yield line, None, f"Values must be strings: {', '.join(not_text)}."
+                continue
+            yield line, record, None
+
+
+def allocate_patient_ids(count):
+    """Generates `count` unused patient_ids, checking uniqueness with one query per round."""
+    allocated = set()
+    while len(allocated) < count:
+        candidates = {generate_custom_id('PAT') for _ in range(count - len(allocated))} - allocated
+        candidates -= set(Patient.objects.filter(patient_id__in=candidates).values_list('patient_id', flat=True))
+        allocated |= candidates
+    return list(allocated)
+
+
+def _error_message(exc):
+    if isinstance(exc, ValidationError) and hasattr(exc, 'message_dict'):
+        return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in exc.message_dict.items())
+    return ' '.join(getattr(exc, 'messages', [str(exc)]))
+
+
+class BulkImporter:
+    """
+    Imports patients (with their users), EMRs and prescriptions in batches.
+
+    Every batch is validated up front, then written with bulk_create in
+    dependency order (User -> Patient -> EMR/Prescription) inside one
+    transaction that also advances the ImportJob, so an interrupted import
+    resumes after the last committed batch. EMRs and prescriptions go to
+    their patient's shard, in transactions that commit just before it.
+    Source references ('ref' on a patient, 'patient_ref' on clinical
+    records) are resolved through an in-memory map backed by ImportRef rows.
+    """
+    def __init__(self, job, batch_size=1000, errors=None, progress=None):
+        self.job = job
+        self.batch_size = batch_size
+        self.errors = errors # Writable text file for per-row errors
+        self.progress = progress or (lambda message: None)
+        self.refs = {}
+
+    def run(self, records):
+        batch = []
+        for item in records:
+            if item[0] <= self.job.last_line:
+                continue
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        self.job.completed_at = timezone.now()
+        self.job.save(update_fields=['completed_at'])
+
+    def _import_batch(self, batch):
+        errors = []
+        patients, clinical = [], []
+        for line, record, error in batch:
+            try:
+                if error:
+                    raise RowError(error)
+                kind = record.get('type', 'patient')
+                if kind == 'patient':
+                    patients.append((line, self._build_patient(record)))
+                elif kind in CLINICAL_FIELDS:
+                    clinical.append((line, self._build_clinical(kind, record)))
+                else:
+                    raise RowError(f"Unknown record type '{kind}'.")
+            except (RowError, ValidationError) as exc:
+                errors.append((line, _error_message(exc)))
+
+        with atomic_on('default', *shard_aliases()):
+            created = self._create_patients(patients, errors)
+            created += self._create_clinical(clinical, errors)
+            self.job.last_line = batch[-1][0]
+            self.job.created_rows += created
+            self.job.error_rows += len(errors)
+            self.job.save(update_fields=['last_line', 'created_rows', 'error_rows'])
+
+        for line, message in sorted(errors):
+            if self.errors is not None:
+                self.errors.write(json.dumps({'line': line, 'error': message}) + '\n')
+        self.progress(
+            f"Line {self.job.last_line}: {self.job.created_rows} rows created, "
+            f"{self.job.error_rows} errors so far."
+        )
+
+    def _build_patient(self, record):
+        username = (record.get('username') or '').strip()
+        if not username:
+            raise RowError("'username' is required.")
+        # Pre-hashed passwords are taken as-is; hashing per row is what made
+        # registration slow. Users without one must reset their password.
+        password_hash = record.get('password_hash')
+        if password_hash:
+            try:
+                identify_hasher(password_hash) # Anything else may be a plaintext password
+            except ValueError:
+                raise RowError("'password_hash' is not a hash from one of PASSWORD_HASHERS.")
+        user = User(
+            username=username,
+            email=(record.get('email') or '').strip(),
+            password=password_hash or make_password(None),
+        )
+        user.clean_fields(exclude=['last_login', 'date_joined'])
+        values = {field: record.get(field) or '' for field in PATIENT_FIELDS}
+        values['date_of_birth'] = values['date_of_birth'] or None
+        values['gender'] = values['gender'] or None
+        patient = Patient(**values)
+        patient.clean_fields(exclude=['user', 'patient_id'])
+        return user, patient, (record.get('ref') or '').strip()
+
+    def _build_clinical(self, kind, record):
+        model, fields = CLINICAL_FIELDS[kind]
+        obj = model(
+            doctor_id=(record.get('doctor_id') or '').strip() or None,
+            **{field: record.get(field) or '' for field in fields},
+        )
+        obj.clean_fields(exclude=['patient', 'doctor'])
+        if obj.doctor_id is None and not model._meta.get_field('doctor').null:
+            raise RowError("'doctor_id' is required.")
+        patient_ref = (record.get('patient_ref') or '').strip()
+        patient_id = (record.get('patient_id') or '').strip()
+        if not patient_ref and not patient_id:
+            raise RowError("'patient_ref' or 'patient_id' is required.")
+        return obj, patient_ref, patient_id
+
+    def _load_refs(self, refs):
+        missing = [ref for ref in refs if ref and ref not in self.refs]
+        if missing:
+            self.refs.update(
+                ImportRef.objects.filter(job=self.job, ref__in=missing).values_list('ref', 'patient_id')
+            )
+
+    def _create_patients(self, rows, errors):
+        self._load_refs([ref for _, (_, _, ref) in rows])
+        taken = set(User.objects.filter(
+            username__in=[user.username for _, (user, _, _) in rows]
+        ).values_list('username', flat=True))
+        # Usernames are compared case-insensitively, as MySQL's collation does
+        taken = {username.casefold() for username in taken}
+        batch_refs = set()
+        accepted = []
+        for line, (user, patient, ref) in rows:
+            if user.username.casefold() in taken:
+                errors.append((line, f"Username '{user.username}' already exists."))
+            elif ref and (ref in self.refs or ref in batch_refs):
+                errors.append((line, f"Patient ref '{ref}' was already imported."))
+            else:
+                taken.add(user.username.casefold())
+                batch_refs.add(ref)
+                accepted.append((line, user, patient, ref))
+        if not accepted:
+            return 0
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user for _, user, _, _ in accepted], batch_size=self.batch_size)
+        except IntegrityError:
+            # E.g. a username differing only in case from an existing one:
+            # insert the users one at a time to report the rows that clash
+            accepted = self._create_users_singly(accepted, errors)
+        # Not every backend returns primary keys from bulk_create, so map them back by username
+        user_ids = dict(User.objects.filter(
+            username__in=[user.username for _, user, _, _ in accepted]
+        ).values_list('username', 'id'))
+        new_refs = []
+        for (_, user, patient, ref), patient_id in zip(accepted, allocate_patient_ids(len(accepted))):
+            patient.user_id = user_ids[user.username]
+            patient.patient_id = patient_id
+            if ref:
+                new_refs.append(ImportRef(job=self.job, ref=ref, patient_id=patient_id))
+        Patient.objects.bulk_create([patient for _, _, patient, _ in accepted], batch_size=self.batch_size)
+        ImportRef.objects.bulk_create(new_refs, batch_size=self.batch_size)
+        self.refs.update((ref.ref, ref.patient_id) for ref in new_refs)
+        return len(accepted)
+
+    def _create_users_singly(self, accepted, errors):
+        created = []
+        for line, user, patient, ref in accepted:
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError:
+                errors.append((line, f"Username '{user.username}' already exists."))
+            else:
+                created.append((line, user, patient, ref))
+        return created
+
+    def _create_clinical(self, rows, errors):
+        self._load_refs([ref for _, (_, ref, _) in rows])
+        known_patients = set(Patient.objects.filter(
+            patient_id__in={patient_id for _, (_, _, patient_id) in rows if patient_id}
+        ).values_list('patient_id', flat=True))
+        known_doctors = set(Doctor.objects.filter(
+            doctor_id__in={obj.doctor_id for _, (obj, _, _) in rows if obj.doctor_id}
+        ).values_list('doctor_id', flat=True))
+
+        by_model = {}
+        for line, (obj, patient_ref, patient_id) in rows:
+            if patient_ref:
+                patient_id = self.refs.get(patient_ref)
+                if patient_id is None:
+                    errors.append((line, f"Unknown patient_ref '{patient_ref}'."))
+                    continue
+            elif patient_id not in known_patients:
+                errors.append((line, f"Unknown patient_id '{patient_id}'."))
+                continue
+            if obj.doctor_id and obj.doctor_id not in known_doctors:
+                errors.append((line, f"Unknown doctor_id '{obj.doctor_id}'."))
+                continue
+            obj.patient_id = patient_id
+            by_model.setdefault(type(obj), []).append(obj)
+
+        for model, objs in by_model.items():
+            by_shard = {}
+            for obj in assign_ids(objs):
+                by_shard.setdefault(shard_for(obj.patient_id), []).append(obj)
+            for alias, shard_objs in by_shard.items():
+                model.objects.using(alias).bulk_create(shard_objs, batch_size=self.batch_size)
+        return sum(len(objs) for objs in by_model.values())
@@ -0,0 +1,250 @@
+# core/dashboard.py
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Appointment, DoctorDailyStat, DoctorPatientLink, DoctorStat, EMR, Prescription
+from .sharding import shard_aliases
+
+# Appointment status -> DoctorDailyStat column
+STATUS_FIELDS = {
+    'Requested': 'requested',
+    'Approved': 'approved',
+    'Rescheduled': 'rescheduled',
+    'Cancelled': 'cancelled',
+}
+DAY_FIELDS = list(STATUS_FIELDS.values()) + ['prescriptions']
+DASHBOARD_DAYS = 7
+
+_state = threading.local()
+
+
+@contextmanager
+def paused():
+    """Stops the signal receivers updating the summary tables, e.g. while rows are moved between shards."""
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def is_paused():
+    return getattr(_state, 'paused', False)
+
+
+def _deleting_doctors():
+    if not hasattr(_state, 'deleting_doctors'):
+        _state.deleting_doctors = set()
+    return _state.deleting_doctors
+
+
+def doctor_deleting(doctor_id):
+    # The doctor's summary rows are deleted with it, so updates to them from
+    # its cascading records must not recreate them
+    _deleting_doctors().add(doctor_id)
+
+
+def doctor_deleted(doctor_id):
+    _deleting_doctors().discard(doctor_id)
+
+
+def contribution(instance, values=None):
+    """
+    What one Appointment, Prescription or EMR adds to the summary tables, as
+    a Counter of ('day', doctor_id, date, column), ('pending', doctor_id) and
+    ('link', doctor_id, patient_id) keys. `values` overrides the instance's
+    current field values (e.g. with the ones it was loaded with).
+    """
+    def value(name):
+        return values[name] if values is not None and name in values else getattr(instance, name)
+
+    counts = Counter()
+    doctor_id = value('doctor_id')
+    if doctor_id is None:
+        return counts
+    counts[('link', doctor_id, value('patient_id'))] += 1
+    if isinstance(instance, Appointment):
+        column = STATUS_FIELDS.get(value('status'))
+        if column:
+            counts[('day', doctor_id, timezone.localdate(value('appointment_datetime')), column)] += 1
+        if value('status') == 'Requested':
+            counts[('pending', doctor_id)] += 1
+    elif isinstance(instance, Prescription):
+        counts[('day', doctor_id, timezone.localdate(value('created_at')), 'prescriptions')] += 1
+    return counts
+
+
+def apply_delta(delta):
+    """Adds a contribution delta to the summary tables with F() updates."""
+    days = defaultdict(Counter)
+    links = Counter()
+    doctors = defaultdict(Counter)
+    deleting = _deleting_doctors()
+    for key, amount in delta.items():
+        if not amount or key[1] in deleting:
+            continue
+        if key[0] == 'day':
+            days[key[1], key[2]][key[3]] += amount
+        elif key[0] == 'link':
+            links[key[1], key[2]] += amount
+        else:
+            doctors[key[1]]['pending_requests'] += amount
+
+    with transaction.atomic():
+        for (doctor_id, date), columns in days.items():
+            DoctorDailyStat.objects.get_or_create(doctor_id=doctor_id, date=date)
+            DoctorDailyStat.objects.filter(doctor_id=doctor_id, date=date).update(
+                **{column: F(column) + amount for column, amount in columns.items()}
+            )
+        for (doctor_id, patient_id), amount in links.items():
+            link, _ = DoctorPatientLink.objects.select_for_update().get_or_create(
+                doctor_id=doctor_id, patient_id=patient_id,
+            )
+            was_linked = link.records > 0
+            link.records += amount
+            if link.records > 0:
+                link.save(update_fields=['records'])
+            else:
+                link.delete()
+            # The patient count only changes when the first / last record comes or goes
+            doctors[doctor_id]['active_patients'] += (link.records > 0) - was_linked
+        for doctor_id, columns in doctors.items():
+            columns = {column: amount for column, amount in columns.items() if amount}
+            if not columns:
+                continue
+            DoctorStat.objects.get_or_create(doctor_id=doctor_id)
+            DoctorStat.objects.filter(doctor_id=doctor_id).update(
+                **{column: F(column) + amount for column, amount in columns.items()}
+            )
+
+
+def record_saved(instance, created):
+    loaded = getattr(instance, '_loaded_values', None)
+    delta = contribution(instance)
+    if not created:
+        # Only the change matters; without the loaded values it can't be known
+        if loaded is None:
+            return
+        delta.subtract(contribution(instance, loaded))
+    apply_delta(delta)
+    instance._loaded_values = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+
+
+def record_deleted(instance):
+    delta = Counter()
+    delta.subtract(contribution(instance))
+    apply_delta(delta)
+
+
+def doctor_dashboard(doctor_id, today=None):
+    """
+    The doctor's dashboard numbers: at most DASHBOARD_DAYS DoctorDailyStat
+    rows and one DoctorStat row are read, whatever the doctor's history.
+    """
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=DASHBOARD_DAYS - 1)
+    rows = {
+        row.date: row
+        for row in DoctorDailyStat.objects.filter(doctor_id=doctor_id, date__gte=first_day, date__lte=today)
+    }
+    stat = DoctorStat.objects.filter(doctor_id=doctor_id).first()
+    days = [first_day + timedelta(days=offset) for offset in range(DASHBOARD_DAYS)]
+    today_row = rows.get(today)
+    return {
+        'date': today,
+        'appointments_today': {
+            status: getattr(today_row, column) if today_row else 0 for status, column in STATUS_FIELDS.items()
+        },
+        'pending_requests': stat.pending_requests if stat else 0,
+        'prescriptions_this_week': sum(row.prescriptions for row in rows.values()),
+        'prescriptions_by_day': [
+            {'date': day, 'count': rows[day].prescriptions if day in rows else 0} for day in days
+        ],
+        'active_patients': stat.active_patients if stat else 0,
+    }
+
+
+def expected_stats(doctor_ids=None):
+    """
+    The summary tables recomputed from the raw records on every shard, as
+    (days, doctors, links): {(doctor_id, date): Counter of columns},
+    {doctor_id: Counter of DoctorStat columns} and {(doctor_id, patient_id): records}.
+    """
+    days = defaultdict(Counter)
+    doctors = defaultdict(Counter)
+    links = Counter()
+
+    def scoped(queryset):
+        queryset = queryset.exclude(doctor_id=None).order_by()
+        return queryset.filter(doctor_id__in=doctor_ids) if doctor_ids else queryset
+
+    for alias in shard_aliases():
+        appointments = scoped(Appointment.objects.using(alias))
+        for row in (
+            appointments.annotate(day=TruncDate('appointment_datetime'))
+            .values('doctor_id', 'day', 'status').annotate(n=Count('id'))
+        ):
+            column = STATUS_FIELDS.get(row['status'])
+            if column:
+                days[row['doctor_id'], row['day']][column] += row['n']
+            if row['status'] == 'Requested':
+                doctors[row['doctor_id']]['pending_requests'] += row['n']
+        prescriptions = scoped(Prescription.objects.using(alias))
+        for row in prescriptions.annotate(day=TruncDate('created_at')).values('doctor_id', 'day').annotate(n=Count('id')):
+            days[row['doctor_id'], row['day']]['prescriptions'] += row['n']
+        for model in [Appointment, Prescription, EMR]:
+            for row in scoped(model.objects.using(alias)).values('doctor_id', 'patient_id').annotate(n=Count('id')):
+                links[row['doctor_id'], row['patient_id']] += row['n']
+
+    for doctor_id, _ in links:
+        doctors[doctor_id]['active_patients'] += 1
+    return days, doctors, links
+
+
+def stored_stats(doctor_ids=None):
+    """The summary tables as they are, in the shape of expected_stats()."""
+    def scoped(queryset):
+        return queryset.filter(doctor_id__in=doctor_ids) if doctor_ids else queryset
+
+    days = defaultdict(Counter)
+    for row in scoped(DoctorDailyStat.objects.all()).values('doctor_id', 'date', *DAY_FIELDS):
+        days[row['doctor_id'], row['date']].update({column: row[column] for column in DAY_FIELDS if row[column]})
+    doctors = defaultdict(Counter)
+    for row in scoped(DoctorStat.objects.all()).values('doctor_id', 'pending_requests', 'active_patients'):
+        doctors[row['doctor_id']].update({
+            column: row[column] for column in ['pending_requests', 'active_patients'] if row[column]
+        })
+    links = Counter(dict(
+        ((doctor_id, patient_id), records)
+        for doctor_id, patient_id, records in scoped(DoctorPatientLink.objects.all())
+        .values_list('doctor_id', 'patient_id', 'records')
+    ))
+    return days, doctors, links
+
+
+def rebuild_doctor_stats(doctor_ids, days, doctors, links):
+    """Replaces the summary rows of `doctor_ids` with the given (expected) ones."""
+    doctor_ids = set(doctor_ids)
+    with transaction.atomic():
+        for model in [DoctorDailyStat, DoctorStat, DoctorPatientLink]:
+            model.objects.filter(doctor_id__in=doctor_ids).delete()
+        DoctorDailyStat.objects.bulk_create([
+            DoctorDailyStat(doctor_id=doctor_id, date=date, **columns)
+            for (doctor_id, date), columns in days.items() if doctor_id in doctor_ids and +columns
+        ])
+        DoctorStat.objects.bulk_create([
+            DoctorStat(doctor_id=doctor_id, **columns)
+            for doctor_id, columns in doctors.items() if doctor_id in doctor_ids and +columns
+        ])
+        DoctorPatientLink.objects.bulk_create([
+            DoctorPatientLink(doctor_id=doctor_id, patient_id=patient_id, records=records)
+            for (doctor_id, patient_id), records in links.items() if doctor_id in doctor_ids and records
+        ])
@@ -0,0 +1,63 @@
+# core/export.py
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Patient, EMR, Prescription, Appointment, HealthMetric
+from .sharding import aliases_for
+
+# resource name -> (model, timestamp field used for incremental `since` exports)
+EXPORT_RESOURCES = {
+    'patients': (Patient, None),
+    'emrs': (EMR, 'updated_at'),
+    'prescriptions': (Prescription, 'created_at'),
+    'appointments': (Appointment, 'updated_at'),
+    'healthmetrics': (HealthMetric, 'recorded_at'),
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def export_queryset(resource, since=None):
+    """Rows of `resource` as plain dicts (FKs as their raw ids), in primary key order per shard."""
+    model, timestamp_field = EXPORT_RESOURCES[resource]
+    queryset = model.objects.order_by('pk')
+    if since is not None:
+        if timestamp_field is None:
+            raise ValueError(f"'{resource}' has no timestamp, so it can only be exported in full.")
+        queryset = queryset.filter(**{f'{timestamp_field}__gte': since})
+    return queryset.values(*[field.attname for field in model._meta.concrete_fields])
+
+
+def ndjson_lines(resource, since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields one encoded JSON line per row, one shard after another. Rows are
+    read in primary key order, `chunk_size` at a time by keyset pagination,
+    so memory use does not grow with the table (.iterator() would not
+    stream with mysqlclient, which buffers the whole result set).
+    """
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    queryset = export_queryset(resource, since)
+    pk_name = queryset.model._meta.pk.attname
+    for alias in aliases_for(queryset.model):
+        last_pk = None
+        while True:
+            chunk = queryset.using(alias)
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            rows = list(chunk[:chunk_size])
+            for row in rows:
+                yield (encoder.encode(row) + '\n').encode('utf-8')
+            if len(rows) < chunk_size:
+                break
+            last_pk = rows[-1][pk_name]
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compresses a stream of bytes chunks without buffering it all."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.archive import ARCHIVE_KINDS, archive_older_than, archive_settings
+
+
+class Command(BaseCommand):
+    help = "Moves old Message and HealthMetric rows into compressed archive segments."
+
+    def add_arguments(self, parser):
+        config = archive_settings()
+        parser.add_argument('--older-than-days', type=int, default=config['OLDER_THAN_DAYS'])
+        parser.add_argument('--kind', choices=sorted(ARCHIVE_KINDS), action='append',
+                            help="Archive only this kind (repeatable; default: all).")
+        parser.add_argument('--segment-rows', type=int, default=config['SEGMENT_ROWS'])
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        for kind in options['kind'] or sorted(ARCHIVE_KINDS):
+            moved = archive_older_than(kind, cutoff, options['segment_rows'])
+            self.stdout.write(f"Archived {moved} {kind} row(s) older than {cutoff:%Y-%m-%d}.")
@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from core.export import DEFAULT_CHUNK_SIZE, EXPORT_RESOURCES, gzip_stream, ndjson_lines
+
+
+class Command(BaseCommand):
+    help = "Streams a resource as NDJSON (optionally gzipped) to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(EXPORT_RESOURCES))
+        parser.add_argument('--since', help="Only rows created/updated at or after this ISO datetime.")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', '-o', help="Output file (default: stdout).")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError("--since must be an ISO 8601 datetime.")
+
+        try:
+            chunks = ndjson_lines(options['resource'], since, options['chunk_size'])
+            if options['gzip']:
+                chunks = gzip_stream(chunks)
+            if options['output']:
+                with open(options['output'], 'wb') as output:
+                    for chunk in chunks:
+                        output.write(chunk)
+            else:
+                for chunk in chunks:
+                    sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+        except ValueError as exc:
+            raise CommandError(exc)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk_import import BulkImporter, read_records
+from core.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-imports patients, EMRs and prescriptions from CSV (patients only) "
+        "or NDJSON. Re-running the same --job resumes after the last committed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="Defaults to the file extension.")
+        parser.add_argument('--job', help="Name used to resume the import (default: the file path).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help="Where to write per-row errors (default: <path>.errors.ndjson).")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        job, created = ImportJob.objects.get_or_create(name=options['job'] or path, defaults={'source': path})
+        if job.completed_at:
+            raise CommandError(f"Import '{job.name}' already completed at {job.completed_at}.")
+        if not created:
+            self.stdout.write(f"Resuming '{job.name}' after line {job.last_line}.")
+
+        try:
+            with open(options['errors'] or f"{path}.errors.ndjson", 'a', encoding='utf-8') as errors:
+                importer = BulkImporter(job, options['batch_size'], errors, self.stdout.write)
+                importer.run(read_records(path, fmt))
+        except OSError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f"Import '{job.name}' finished: {job.created_rows} rows created, {job.error_rows} errors."
+        ))
@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: imports the entry point, then serves one request
+# through it and prints the timings as JSON
+CHILD_SCRIPT = r'''
+import asyncio, io, json, sys, time
+started = time.perf_counter()
+module = __import__(sys.argv[1], fromlist=['application'])
+imported = time.perf_counter()
+path, query = (sys.argv[2].split('?', 1) + [''])[:2]
+if sys.argv[1].endswith('asgi'):
+    messages, requested = [], []
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait() # The client never disconnects
+    async def send(message):
+        messages.append(message)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    asyncio.run(module.application(scope, receive, send))
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+else:
+    statuses = []
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'localhost',
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+    }
+    response = module.application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    status = int(statuses[0].split()[0])
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': status,
+}))
+'''
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def parse_import_times(stderr):
+    """(module, self us, cumulative us, depth) for each line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            rows.append((match[4], int(match[1]), int(match[2]), len(match[3]) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures worker startup in fresh interpreters: import time per module "
+        "(python -X importtime) and time to the first request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry-point', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--path', default='/api/metrics/', help="URL of the first request.")
+        parser.add_argument('--runs', type=int, default=3, help="Interpreters to start; medians are reported.")
+        parser.add_argument('--top', type=int, default=15, help="Slowest modules to list.")
+        parser.add_argument('--budget-ms', type=float,
+                            help="Fail if the median import + first request time exceeds this.")
+
+    def handle(self, *args, **options):
+        module = f"{settings.ROOT_URLCONF.split('.')[0]}.{options['entry_point']}"
+        env = {**os.environ, 'PYTHONWARNINGS': 'ignore'}
+        timings, import_times = [], []
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT, module, options['path']],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                raise CommandError(f"Starting {module} failed:\n{result.stderr[-2000:]}")
+            timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            import_times.append(parse_import_times(result.stderr))
+
+        # Module import times are taken from the run with the median total
+        totals = [timing['import_ms'] + timing['first_request_ms'] for timing in timings]
+        median_run = sorted(range(len(totals)), key=totals.__getitem__)[len(totals) // 2]
+        rows = import_times[median_run]
+
+        self.stdout.write(f"Slowest imports ({module}, cumulative ms):")
+        for name, _, cumulative, depth in sorted(rows, key=lambda row: -row[2])[:options['top']]:
+            self.stdout.write(f"  {cumulative / 1000:8.1f}  {'  ' * depth}{name}")
+        by_package = defaultdict(int)
+        for name, self_us, _, _ in rows:
+            by_package[name.split('.')[0]] += self_us
+        self.stdout.write("Import time by top-level package (self ms):")
+        for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"  {self_us / 1000:8.1f}  {package}")
+
+        import_ms = statistics.median(timing['import_ms'] for timing in timings)
+        first_request_ms = statistics.median(timing['first_request_ms'] for timing in timings)
+        total_ms = statistics.median(totals)
+        self.stdout.write(
+            f"Import {import_ms:.1f} ms, first request {first_request_ms:.1f} ms "
+            f"(HTTP {timings[median_run]['status']}), total {total_ms:.1f} ms "
+            f"(median of {len(timings)} run(s))."
+        )
+        budget = options['budget_ms']
+        if budget is not None:
+            if total_ms > budget:
+                raise CommandError(f"Startup took {total_ms:.1f} ms, over the {budget:g} ms budget.")
+            self.stdout.write(self.style.SUCCESS(f"Within the {budget:g} ms budget."))
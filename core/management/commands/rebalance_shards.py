@@ -0,0 +1,44 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from core.models import Appointment, EMR, HealthMetric, Prescription
+from core.sharding import move_patients, shard_aliases, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves patient records that are not on the shard their patient_id hashes to, "
+        "e.g. after an alias is added to PATIENT_SHARDS (migrate it first)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Patients moved per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        totals = Counter()
+        for source in shard_aliases():
+            patient_ids = set()
+            for model in [EMR, Prescription, Appointment, HealthMetric]:
+                patient_ids.update(
+                    model.objects.using(source).order_by().values_list('patient_id', flat=True).distinct()
+                )
+            misplaced = {}
+            for patient_id in sorted(patient_ids):
+                target = shard_for(patient_id)
+                if target != source:
+                    misplaced.setdefault(target, []).append(patient_id)
+
+            for target, ids in misplaced.items():
+                self.stdout.write(f"{len(ids)} patient(s) to move from '{source}' to '{target}'.")
+                if options['dry_run']:
+                    continue
+                for start in range(0, len(ids), batch_size):
+                    totals.update(move_patients(ids[start:start + batch_size], source, target))
+
+        if options['dry_run']:
+            return
+        summary = ', '.join(f"{count} {label.split('.')[1]}" for label, count in sorted(totals.items()))
+        self.stdout.write(self.style.SUCCESS(f"Moved {summary or 'nothing'}."))
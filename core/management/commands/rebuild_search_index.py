@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.models import EMR
+from core.search import index_emr
+from core.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the EMR search index (e.g. after a bulk import, which skips signals)."
+
+    def handle(self, *args, **options):
+        indexed = 0
+        for alias in shard_aliases():
+            for emr_id in EMR.objects.using(alias).order_by('pk').values_list('pk', flat=True).iterator(chunk_size=2000):
+                index_emr(emr_id, alias)
+                indexed += 1
+                if indexed % 1000 == 0:
+                    self.stdout.write(f"Indexed {indexed} EMRs...")
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} EMRs."))
@@ -0,0 +1,48 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from core.dashboard import expected_stats, rebuild_doctor_stats, stored_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks the doctor dashboard summary tables against the appointments, prescriptions "
+        "and EMRs on every shard, and with --fix rebuilds the doctors that differ "
+        "(e.g. after a bulk import, which skips signals)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', action='append', help="Only check this doctor_id (repeatable).")
+        parser.add_argument('--fix', action='store_true', help="Rewrite the summary rows of mismatched doctors.")
+
+    def handle(self, *args, **options):
+        expected = expected_stats(options['doctor'])
+        stored = stored_stats(options['doctor'])
+
+        mismatched = set()
+        for table, wanted, actual in zip(['DoctorDailyStat', 'DoctorStat', 'DoctorPatientLink'], expected, stored):
+            for key in sorted(set(wanted) | set(actual), key=str):
+                # Zero counters and missing rows are the same thing
+                want, have = wanted.get(key), actual.get(key)
+                if table != 'DoctorPatientLink':
+                    want, have = +(want or Counter()), +(have or Counter())
+                if want != have:
+                    doctor_id = key[0] if isinstance(key, tuple) else key
+                    mismatched.add(doctor_id)
+                    self.stdout.write(f"{table} {key}: expected {_show(want)}, stored {_show(have)}")
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS("Doctor stats match the raw records."))
+            return
+        if options['fix']:
+            rebuild_doctor_stats(mismatched, *expected)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the stats of {len(mismatched)} doctor(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"Stats of {len(mismatched)} doctor(s) differ; run with --fix to rebuild them."
+            ))
+
+
+def _show(value):
+    return dict(value) if isinstance(value, dict) else value
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Prescription
+from core.safety import check_prescription
+from core.sharding import for_patient, shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-screens every prescription against its patient's allergies and current "
+        "medications, e.g. after the drug safety dataset changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', help="Only screen this patient_id's prescriptions.")
+
+    def handle(self, *args, **options):
+        # Prescriptions have no end date, so all of them count as active.
+        # Patients live on 'default', so they're prefetched rather than joined.
+        prescriptions = Prescription.objects.prefetch_related('patient').order_by('pk')
+        if options['patient']:
+            shards = [for_patient(prescriptions.filter(patient_id=options['patient']), options['patient'])]
+        else:
+            shards = [prescriptions.using(alias) for alias in shard_aliases()]
+
+        screened = flagged = 0
+        for queryset in shards:
+            for prescription in queryset.iterator(chunk_size=2000):
+                screened += 1
+                warnings = check_prescription(prescription.medication_name, prescription.patient)
+                if warnings:
+                    flagged += 1
+                for warning in warnings:
+                    self.stdout.write(
+                        f"Prescription {prescription.pk} ({prescription.patient_id}) "
+                        f"[{warning['severity']} {warning['type']}]: {warning['message']}"
+                    )
+        self.stdout.write(self.style.SUCCESS(f"Screened {screened} prescriptions, {flagged} with warnings."))
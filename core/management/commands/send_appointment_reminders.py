@@ -0,0 +1,28 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.reminders import reminder_settings, send_due_reminders
+
+
+class Command(BaseCommand):
+    help = "Sends reminder messages for approved appointments starting soon."
+
+    def add_arguments(self, parser):
+        config = reminder_settings()
+        parser.add_argument('--lead-hours', type=float, default=config['LEAD_TIME_HOURS'],
+                            help="Remind about appointments starting within this many hours.")
+        parser.add_argument('--batch-size', type=int, default=config['BATCH_SIZE'])
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, one tick every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        lead_time = timedelta(hours=options['lead_hours'])
+        while True:
+            reminded = send_due_reminders(lead_time=lead_time, batch_size=options['batch_size'])
+            self.stdout.write(f"Sent reminders for {reminded} appointment(s).")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,163 @@
+# core/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Bucket boundaries for the in-process histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROFILING_DEFAULTS = {
+    'ENABLED': True,
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+    'PROFILE_REQUESTS': False,
+    'ALLOW_PROFILE_HEADER': False,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'PROFILE_DIR': 'profiles',
+}
+
+
+def profiling_settings():
+    """Returns REQUEST_PROFILING from settings merged over the defaults."""
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+class Histogram:
+    """A fixed-bucket histogram (non-cumulative counts, cumulated on export)."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of labelled histograms, exported in the Prometheus
+    text exposition format.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (help, buckets, {labels: Histogram})
+
+    def register(self, name, help_text, buckets):
+        with self._lock:
+            self._metrics.setdefault(name, (help_text, buckets, {}))
+
+    def observe(self, name, value, **labels):
+        help_text, buckets, series = self._metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets, series) in self._metrics.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    labels = ','.join(f'{k}="{_escape(v)}"' for k, v in key)
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else repr(float(bound))
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+registry.register('http_request_duration_seconds', 'Total time spent handling the request.', DURATION_BUCKETS)
+registry.register('http_request_phase_seconds', 'Time spent per phase (db, serializer, render, pdf).', DURATION_BUCKETS)
+registry.register('http_request_db_queries', 'Number of SQL queries run by the request.', QUERY_COUNT_BUCKETS)
+registry.register('http_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS)
+
+
+class RequestProfile:
+    """
+    Accumulates the per-phase timings of a single request. A phase is only
+    in `phases` once it has run, e.g. 'db' after the first query.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self._active = set()
+        self._lock = threading.Lock() # Shard fan-out runs queries from several threads
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper() for every DB alias
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases['db'] = self.phases.get('db', 0.0) + elapsed
+                self.queries += 1
+
+
+_current_profile = ContextVar('current_request_profile', default=None)
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+@contextmanager
+def activate(profile):
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to `phase` of the current request.
+    Queries run inside the block are counted as 'db' time only, and nested
+    blocks of the same phase are not counted twice.
+    """
+    profile = _current_profile.get()
+    if profile is None or phase in profile._active:
+        yield
+        return
+    profile._active.add(phase)
+    db_before = profile.phases.get('db', 0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (profile.phases.get('db', 0.0) - db_before)
+        profile.phases[phase] = profile.phases.get(phase, 0.0) + max(elapsed, 0.0)
+        profile._active.discard(phase)
+
+
+def record_request(view, profile, duration, response_size=None):
+    registry.observe('http_request_duration_seconds', duration, view=view)
+    # Only the phases the request went through, so e.g. JSON requests don't pile up pdf=0
+    for phase, seconds in profile.phases.items():
+        registry.observe('http_request_phase_seconds', seconds, view=view, phase=phase)
+    registry.observe('http_request_db_queries', profile.queries, view=view)
+    if response_size is not None:
+        registry.observe('http_response_size_bytes', response_size, view=view)
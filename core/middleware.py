@@ -0,0 +1,78 @@
+# core/middleware.py
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import RequestProfile, activate, current_profile, profiling_settings, record_request
+
+
+class RequestProfilingMiddleware:
+    """
+    Records DB/serializer/render/PDF timings, query count and response size
+    for every request, labelled with the resolved URL name.
+
+    With REQUEST_PROFILING['PROFILE_REQUESTS'] (or the X-Profile-Request
+    header when ALLOW_PROFILE_HEADER is on) the request also runs under
+    cProfile, and requests slower than SLOW_REQUEST_SECONDS are dumped as
+    .prof files that snakeviz / flameprof can turn into a flamegraph.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = profiling_settings()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        profiler = self._start_profiler(request)
+        start = time.perf_counter()
+        with activate(profile), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile.execute_wrapper))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        record_request(view, profile, duration, size)
+
+        if profiler is not None:
+            profiler.disable()
+            if duration >= self.config['SLOW_REQUEST_SECONDS'] or self._profile_forced(request):
+                self._dump_profile(profiler, view)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns, so time
+        # from here until the post-render callback fires.
+        profile = current_profile()
+        if profile is not None:
+            start = time.perf_counter()
+
+            def _rendered(rendered_response):
+                profile.phases['render'] = profile.phases.get('render', 0.0) + time.perf_counter() - start
+
+            response.add_post_render_callback(_rendered)
+        return response
+
+    def _profile_forced(self, request):
+        return self.config['ALLOW_PROFILE_HEADER'] and 'HTTP_X_PROFILE_REQUEST' in request.META
+
+    def _start_profiler(self, request):
+        if not (self.config['PROFILE_REQUESTS'] or self._profile_forced(request)):
+            return None
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _dump_profile(self, profiler, view):
+        directory = Path(settings.BASE_DIR) / self.config['PROFILE_DIR']
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{view.replace(':', '_')}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1000000}.prof"
+        profiler.dump_stats(directory / name)
@@ -43,7 +43,7 @@ class Migration(migrations.Migration):
                 ('treatment_plan', models.TextField(blank=True)),
                 ('created_at', models.DateTimeField(auto_now_add=True)),
                 ('updated_at', models.DateTimeField(auto_now=True)),
-                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.doctor', to_field='doctor_id')),
+                ('doctor', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.doctor', to_field='doctor_id')),
             ],
         ),
         migrations.CreateModel(
@@ -91,13 +91,13 @@ class Migration(migrations.Migration):
                 ('value', models.CharField(max_length=50)),
                 ('unit', models.CharField(blank=True, max_length=20)),
                 ('recorded_at', models.DateTimeField(auto_now_add=True)),
-                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+                ('patient', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
             ],
         ),
         migrations.AddField(
             model_name='emr',
             name='patient',
-            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id'),
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id'),
         ),
         migrations.CreateModel(
             name='Appointment',
@@ -107,8 +107,8 @@ class Migration(migrations.Migration):
                 ('status', models.CharField(choices=[('Requested', 'Requested'), ('Approved', 'Approved'), ('Rescheduled', 'Rescheduled'), ('Cancelled', 'Cancelled')], default='Requested', max_length=20)),
                 ('notes', models.TextField(blank=True)),
                 ('created_at', models.DateTimeField(auto_now_add=True)),
-                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.doctor', to_field='doctor_id')),
-                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+                ('doctor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.doctor', to_field='doctor_id')),
+                ('patient', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
             ],
         ),
         migrations.CreateModel(
@@ -119,8 +119,8 @@ class Migration(migrations.Migration):
                 ('dosage', models.CharField(blank=True, max_length=50)),
                 ('instructions', models.TextField(blank=True)),
                 ('created_at', models.DateTimeField(auto_now_add=True)),
-                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.doctor', to_field='doctor_id')),
-                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+                ('doctor', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.doctor', to_field='doctor_id')),
+                ('patient', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
             ],
         ),
     ]
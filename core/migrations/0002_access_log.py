@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.UUIDField(editable=False, unique=True)),
+                ('resource_type', models.CharField(max_length=30)),
+                ('object_id', models.CharField(max_length=50)),
+                ('patient_id', models.CharField(blank=True, max_length=20)),
+                ('action', models.CharField(max_length=20)),
+                ('path', models.CharField(blank=True, max_length=255)),
+                ('accessed_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient_id', 'accessed_at'], name='core_access_patient_6e8013_idx'), models.Index(fields=['user', 'accessed_at'], name='core_access_user_id_e3d060_idx')],
+            },
+        ),
+    ]
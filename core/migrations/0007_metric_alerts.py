@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:16
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric_type', models.CharField(db_index=True, max_length=50)),
+                ('statistic', models.CharField(choices=[('value', 'Latest value'), ('mean', 'Rolling mean'), ('min', 'Rolling minimum'), ('max', 'Rolling maximum'), ('rate', 'Rate of change per hour')], default='value', max_length=10)),
+                ('window', models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(50)])),
+                ('operator', models.CharField(choices=[('gt', 'Above'), ('lt', 'Below')], max_length=2)),
+                ('threshold', models.FloatField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.doctor', to_field='doctor_id')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MetricAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric_type', models.CharField(max_length=50)),
+                ('observed_value', models.FloatField()),
+                ('message', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('acknowledged_at', models.DateTimeField(blank=True, null=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.doctor', to_field='doctor_id')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.alertrule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['doctor', 'acknowledged_at', 'created_at'], name='core_metric_doctor__3b040a_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricSeriesState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric_type', models.CharField(max_length=50)),
+                ('readings', models.JSONField(default=list)),
+                ('breached_rules', models.JSONField(default=list)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.patient', to_field='patient_id')),
+            ],
+            options={
+                'unique_together': {('patient', 'metric_type')},
+            },
+        ),
+    ]
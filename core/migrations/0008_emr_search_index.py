@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_metric_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EMRSearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=40)),
+                ('weight', models.FloatField()),
+                ('emr', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='core.emr')),
+            ],
+            options={
+                'unique_together': {('token', 'emr')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:24
+
+from django.db import migrations, models
+
+# The sharded tables' foreign keys to Patient and Doctor are created without
+# constraints (the parent tables only exist on 'default'), but databases
+# migrated before that was the case still have them.
+SHARDED_FOREIGN_KEYS = [
+    ('appointment', 'doctor'), ('appointment', 'patient'), ('emr', 'doctor'), ('emr', 'patient'),
+    ('healthmetric', 'patient'), ('prescription', 'doctor'), ('prescription', 'patient'),
+]
+
+
+def drop_foreign_key_constraints(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        return # No ALTER TABLE DROP CONSTRAINT; the leftovers only hold rows on 'default' to its own parent tables
+    for model_name, field_name in SHARDED_FOREIGN_KEYS:
+        model = apps.get_model('core', model_name)
+        column = model._meta.get_field(field_name).column
+        for name in schema_editor._constraint_names(model, [column], foreign_key=True):
+            schema_editor.execute(schema_editor._delete_fk_sql(model, name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_emr_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardSequence',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(drop_foreign_key_constraints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_patient_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pending_requests', models.IntegerField(default=0)),
+                ('active_patients', models.IntegerField(default=0)),
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='core.doctor', to_field='doctor_id')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DoctorDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('requested', models.IntegerField(default=0)),
+                ('approved', models.IntegerField(default=0)),
+                ('rescheduled', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('prescriptions', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='core.doctor', to_field='doctor_id')),
+            ],
+            options={
+                'unique_together': {('doctor', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DoctorPatientLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id', models.CharField(max_length=20)),
+                ('records', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patient_links', to='core.doctor', to_field='doctor_id')),
+            ],
+            options={
+                'unique_together': {('doctor', 'patient_id')},
+            },
+        ),
+    ]
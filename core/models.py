@@ -1,7 +1,9 @@
 # core/models.py
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
 from .utils import generate_custom_id # Import the new function
+from .sharding import ShardedQuerySet
 
 # Choices for ENUM fields
 GENDER_CHOICES = (
@@ -17,11 +19,27 @@ APPOINTMENT_STATUS_CHOICES = (
     ('Cancelled', 'Cancelled'),
 )
 
+ALERT_STATISTIC_CHOICES = (
+    ('value', 'Latest value'),
+    ('mean', 'Rolling mean'),
+    ('min', 'Rolling minimum'),
+    ('max', 'Rolling maximum'),
+    ('rate', 'Rate of change per hour'),
+)
+
+ALERT_OPERATOR_CHOICES = (
+    ('gt', 'Above'),
+    ('lt', 'Below'),
+)
+
+# Readings kept per patient/metric series for rolling-window alert rules
+ALERT_MAX_WINDOW = 50
+
 # 1. User-related Profile Models
 class Patient(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     patient_id = models.CharField(max_length=20, unique=True, editable=False)
-    full_name = models.CharField(max_length=100)
+    full_name = models.CharField(max_length=100, db_index=True)
     date_of_birth = models.DateField(null=True, blank=True)
     gender = models.CharField(max_length=10, choices=GENDER_CHOICES, null=True, blank=True)
     phone = models.CharField(max_length=20, blank=True)
@@ -50,7 +68,7 @@ class Doctor(models.Model):
         unique=True,
         editable=False
     )
-    full_name = models.CharField(max_length=100)
+    full_name = models.CharField(max_length=100, db_index=True)
     specialization = models.CharField(max_length=100, blank=True)
     phone = models.CharField(max_length=20, blank=True)
     office_address = models.TextField(blank=True)
@@ -66,25 +84,44 @@ class Doctor(models.Model):
 
 
 # 2. Core Healthcare Models
+# EMRs, prescriptions, lab results, appointments and health metrics live on
+# their patient's shard (see core.sharding); patients and doctors stay on
+# 'default', so foreign keys to them can't be enforced by the database.
 class EMR(models.Model):
-    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
-    doctor = models.ForeignKey(Doctor, to_field='doctor_id', on_delete=models.SET_NULL, null=True, blank=True)
+    patient = models.ForeignKey(Patient, to_field='patient_id', db_constraint=False, on_delete=models.CASCADE)
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', db_constraint=False, on_delete=models.SET_NULL, null=True, blank=True)
     diagnosis = models.TextField(blank=True)
     treatment_plan = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # Incremental exports filter on this
+
+    objects = ShardedQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values)) # Diffed by core.dashboard
+        return instance
 
     def __str__(self):
         return f"EMR for {self.patient.full_name} on {self.created_at.strftime('%Y-%m-%d')}"
 
 class Prescription(models.Model):
     # We are simplifying this model to be more direct
-    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
-    doctor = models.ForeignKey(Doctor, to_field='doctor_id', on_delete=models.CASCADE)
-    medication_name = models.CharField(max_length=100)
+    patient = models.ForeignKey(Patient, to_field='patient_id', db_constraint=False, on_delete=models.CASCADE)
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', db_constraint=False, on_delete=models.CASCADE)
+    medication_name = models.CharField(max_length=100, db_index=True)
     dosage = models.CharField(max_length=50, blank=True)
     instructions = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values)) # Diffed by core.dashboard
+        return instance
 
     def __str__(self):
         return f"{self.medication_name} for {self.patient.full_name}"
@@ -92,20 +129,47 @@ class Prescription(models.Model):
 class LabResult(models.Model):
     emr = models.ForeignKey(EMR, on_delete=models.CASCADE)
     test_name = models.CharField(max_length=100)
-    test_date = models.DateField(null=True, blank=True)
+    test_date = models.DateField(null=True, blank=True, db_index=True)
     result_file_path = models.CharField(max_length=255, blank=True) # Could be a FileField later
     notes = models.TextField(blank=True)
 
+    objects = ShardedQuerySet.as_manager()
+
     def __str__(self):
         return f"Lab Result: {self.test_name} for {self.emr.patient.full_name}"
 
 class Appointment(models.Model):
-    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
-    doctor = models.ForeignKey(Doctor, to_field='doctor_id', on_delete=models.CASCADE)
-    appointment_datetime = models.DateTimeField()
+    patient = models.ForeignKey(Patient, to_field='patient_id', db_constraint=False, on_delete=models.CASCADE)
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', db_constraint=False, on_delete=models.CASCADE)
+    appointment_datetime = models.DateTimeField(db_index=True)
     status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS_CHOICES, default='Requested')
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # Incremental exports pick up status changes by this
+    reminder_sent_at = models.DateTimeField(null=True, blank=True) # Set by the reminder scheduler
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the reminder scheduler's range scan over unsent approved appointments
+            models.Index(fields=['status', 'reminder_sent_at', 'appointment_datetime'], name='appointment_reminder_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_datetime = instance.__dict__.get('appointment_datetime')
+        instance._loaded_values = dict(zip(field_names, values)) # Diffed by core.dashboard
+        return instance
+
+    def save(self, *args, **kwargs):
+        # A rescheduled appointment needs a fresh reminder
+        loaded_datetime = getattr(self, '_loaded_datetime', None)
+        if loaded_datetime is not None and loaded_datetime != self.appointment_datetime:
+            self.reminder_sent_at = None
+        super().save(*args, **kwargs)
+        self._loaded_datetime = self.appointment_datetime
 
     def __str__(self):
         return f"Appointment for {self.patient.full_name} with Dr. {self.doctor.full_name} on {self.appointment_datetime.strftime('%Y-%m-%d %H:%M')}"
@@ -120,11 +184,18 @@ class Message(models.Model):
         return f"From {self.sender.username} to {self.receiver.username} at {self.sent_at.strftime('%H:%M')}"
 
 class HealthMetric(models.Model):
-    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
+    patient = models.ForeignKey(Patient, to_field='patient_id', db_constraint=False, on_delete=models.CASCADE)
     metric_type = models.CharField(max_length=50) # e.g., 'blood_pressure_systolic'
     value = models.CharField(max_length=50)
     unit = models.CharField(max_length=20, blank=True) # e.g., 'mmHg', 'kg'
-    recorded_at = models.DateTimeField(auto_now_add=True)
+    recorded_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'recorded_at']),
+        ]
 
     def __str__(self):
         return f"{self.metric_type} for {self.patient.full_name}: {self.value} {self.unit}"
@@ -142,9 +213,210 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     message = models.TextField()
-    sent_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     # We remove the 'receiver' field as the conversation model handles this now.
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at']),
+        ]
+
+    def __str__(self):
+        return f"From {self.sender.username} at {self.sent_at.strftime('%H:%M')}"
+
+
+# 3. Compliance
+class AccessLog(models.Model):
+    """One read of a clinical record, written in batches by core.audit."""
+    event_id = models.UUIDField(unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    resource_type = models.CharField(max_length=30) # e.g., 'emr', 'prescription', 'patient'
+    object_id = models.CharField(max_length=50)
+    patient_id = models.CharField(max_length=20, blank=True) # Plain copy so the log outlives the patient
+    action = models.CharField(max_length=20) # 'list', 'retrieve' or 'download'
+    path = models.CharField(max_length=255, blank=True)
+    accessed_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient_id', 'accessed_at']),
+            models.Index(fields=['user', 'accessed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.resource_type} {self.object_id} by user {self.user_id} at {self.accessed_at:%Y-%m-%d %H:%M:%S}"
+
+
+# 4. Bulk import bookkeeping
+class ImportJob(models.Model):
+    """Progress of one `manage.py import_records` run, so it can be resumed."""
+    name = models.CharField(max_length=200, unique=True)
+    source = models.CharField(max_length=500)
+    last_line = models.PositiveIntegerField(default=0) # Last input record committed
+    created_rows = models.PositiveIntegerField(default=0)
+    error_rows = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.name} (line {self.last_line})"
+
+class ImportRef(models.Model):
+    """Maps a source system's patient reference to the patient_id it was imported as."""
+    job = models.ForeignKey(ImportJob, related_name='refs', on_delete=models.CASCADE)
+    ref = models.CharField(max_length=100)
+    patient_id = models.CharField(max_length=20)
+
+    class Meta:
+        unique_together = ('job', 'ref')
+
+    def __str__(self):
+        return f"{self.ref} -> {self.patient_id}"
+
+
+# 5. Cold storage
+class ArchiveSegment(models.Model):
+    """
+    Index entry for a compressed file of archived Message or HealthMetric
+    rows belonging to one conversation / patient (see core.archive).
+    """
+    kind = models.CharField(max_length=20) # 'message' or 'healthmetric'
+    key = models.CharField(max_length=50) # Conversation id or patient_id
+    first_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+    row_count = models.PositiveIntegerField()
+    path = models.CharField(max_length=255) # Relative to ARCHIVE['DIR']
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'key', 'last_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} archive for {self.key}: {self.row_count} rows up to {self.last_at:%Y-%m-%d}"
+
+
+# 6. Health metric alerts
+class AlertRule(models.Model):
+    """
+    A threshold on a rolling statistic of one metric type, e.g. mean systolic
+    BP over the last 3 readings above 140. Applies to every patient when
+    `patient` is empty.
+    """
+    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE, null=True, blank=True)
+    metric_type = models.CharField(max_length=50, db_index=True)
+    statistic = models.CharField(max_length=10, choices=ALERT_STATISTIC_CHOICES, default='value')
+    window = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1), MaxValueValidator(ALERT_MAX_WINDOW)]
+    ) # Number of most recent readings the statistic covers
+    operator = models.CharField(max_length=2, choices=ALERT_OPERATOR_CHOICES)
+    threshold = models.FloatField()
+    is_active = models.BooleanField(default=True)
+    created_by = models.ForeignKey(Doctor, to_field='doctor_id', on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_statistic_display()} of {self.metric_type} {self.get_operator_display().lower()} {self.threshold}"
+
+class MetricSeriesState(models.Model):
+    """
+    Compact rolling state of one patient's metric series: the last
+    ALERT_MAX_WINDOW readings and the rules currently in breach.
+    """
+    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
+    metric_type = models.CharField(max_length=50)
+    readings = models.JSONField(default=list) # [[unix timestamp, value], ...], oldest first
+    breached_rules = models.JSONField(default=list)
+
+    class Meta:
+        unique_together = ('patient', 'metric_type')
+
+    def __str__(self):
+        return f"{self.metric_type} series for {self.patient_id}"
+
+class MetricAlert(models.Model):
+    rule = models.ForeignKey(AlertRule, on_delete=models.CASCADE)
+    patient = models.ForeignKey(Patient, to_field='patient_id', on_delete=models.CASCADE)
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', on_delete=models.SET_NULL, null=True, blank=True)
+    metric_type = models.CharField(max_length=50)
+    observed_value = models.FloatField() # The rule's statistic when it fired
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    acknowledged_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', 'acknowledged_at', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Alert for {self.patient_id}: {self.message}"
+
+
+# 7. EMR search
+class EMRSearchPosting(models.Model):
+    """
+    One entry of the inverted index over EMR diagnosis, treatment plan and
+    lab result notes, kept current by core.search.
+    """
+    token = models.CharField(max_length=40)
+    emr = models.ForeignKey(EMR, related_name='search_postings', on_delete=models.CASCADE)
+    weight = models.FloatField() # Field-weighted term frequency
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('token', 'emr')
+
+    def __str__(self):
+        return f"{self.token} -> EMR {self.emr_id}"
+
+
+# 8. Sharding
+class ShardSequence(models.Model):
+    """Next free primary key of a sharded model, handed out in blocks by core.sharding."""
+    name = models.CharField(max_length=100, primary_key=True) # Model label, e.g. 'core.emr'
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+# 9. Doctor dashboard
+# Summary rows kept current by core.dashboard, so the dashboard reads a
+# handful of rows however long the doctor's history is
+class DoctorDailyStat(models.Model):
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', related_name='daily_stats', on_delete=models.CASCADE)
+    date = models.DateField() # Appointment date / prescription date
+    requested = models.IntegerField(default=0) # Appointments by status
+    approved = models.IntegerField(default=0)
+    rescheduled = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    prescriptions = models.IntegerField(default=0) # Prescriptions written
+
+    class Meta:
+        unique_together = ('doctor', 'date')
+
+    def __str__(self):
+        return f"Stats for {self.doctor_id} on {self.date}"
+
+class DoctorStat(models.Model):
+    doctor = models.OneToOneField(Doctor, to_field='doctor_id', related_name='stats', on_delete=models.CASCADE)
+    pending_requests = models.IntegerField(default=0) # Appointments still 'Requested'
+    active_patients = models.IntegerField(default=0) # Patients with a DoctorPatientLink
+
+    def __str__(self):
+        return f"Stats for {self.doctor_id}"
+
+class DoctorPatientLink(models.Model):
+    """How many appointments, EMRs and prescriptions tie a patient to a doctor."""
+    doctor = models.ForeignKey(Doctor, to_field='doctor_id', related_name='patient_links', on_delete=models.CASCADE)
+    patient_id = models.CharField(max_length=20) # Plain value: links go away through their records
+    records = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('doctor', 'patient_id')
+
     def __str__(self):
-        return f"From {self.sender.username} at {self.sent_at.strftime('%H:%M')}"
\ No newline at end of file
+        return f"{self.doctor_id} - {self.patient_id}: {self.records} record(s)"
@@ -1,6 +1,32 @@
 # core/permissions.py
 from rest_framework import permissions
-from .models import Patient, Doctor
+from .models import Patient, Doctor, Appointment, EMR, Prescription
+from .sharding import for_patient, shard_aliases
+
+# The records that make a doctor one of a patient's doctors. DoctorPatientLink
+# counts the same ones, but it is a summary that can drift until it's
+# reconciled, so access checks read the records themselves.
+TREATMENT_MODELS = [Appointment, EMR, Prescription]
+
+
+def treats_patient(doctor, patient_id):
+    """Whether the doctor has an appointment, EMR or prescription with the patient."""
+    return any(
+        for_patient(model.objects.filter(doctor=doctor, patient_id=patient_id), patient_id).exists()
+        for model in TREATMENT_MODELS
+    )
+
+
+def treated_patient_ids(doctor):
+    """The patient_ids of everyone the doctor has an appointment, EMR or prescription with."""
+    patient_ids = set()
+    for alias in shard_aliases():
+        for model in TREATMENT_MODELS:
+            patient_ids.update(
+                model.objects.using(alias).filter(doctor=doctor).order_by().values_list('patient_id', flat=True).distinct()
+            )
+    return patient_ids
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -0,0 +1,131 @@
+# core/reminders.py
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Appointment, Conversation, Message
+from .sharding import shard_aliases
+
+REMINDER_DEFAULTS = {
+    'SENDER_USERNAME': 'reminders',
+    'LEAD_TIME_HOURS': 24,
+    'BATCH_SIZE': 1000,
+}
+
+
+def reminder_settings():
+    """Returns APPOINTMENT_REMINDERS from settings merged over the defaults."""
+    return {**REMINDER_DEFAULTS, **getattr(settings, 'APPOINTMENT_REMINDERS', {})}
+
+
+def is_reserved_username(username):
+    """Usernames of system accounts, which nobody can register."""
+    return username.lower() == reminder_settings()['SENDER_USERNAME'].lower()
+
+
+def get_reminder_sender():
+    """
+    The system user that reminder messages are sent from: inactive and
+    without a usable password, so nobody can log in as it.
+    """
+    user, created = User.objects.get_or_create(
+        username=reminder_settings()['SENDER_USERNAME'], defaults={'is_active': False},
+    )
+    if created:
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    elif user.has_usable_password():
+        # Somebody registered the name; they must not see every patient's reminders
+        raise ImproperlyConfigured(
+            f"User '{user.username}' is not the reminder system account; "
+            f"set APPOINTMENT_REMINDERS['SENDER_USERNAME'] to an unused username."
+        )
+    elif user.is_active:
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+    return user
+
+
+def send_due_reminders(lead_time=None, batch_size=None, now=None):
+    """
+    Sends one reminder Message per patient covering all of their approved
+    appointments starting within `lead_time`, and returns how many
+    appointments were reminded.
+
+    Each batch is one range scan on appointment_reminder_idx of one shard.
+    Appointments are marked with reminder_sent_at in a transaction that
+    commits before the messages' one, so running this again (or in parallel,
+    on MySQL) never sends duplicates.
+    """
+    config = reminder_settings()
+    lead_time = lead_time or timedelta(hours=config['LEAD_TIME_HOURS'])
+    batch_size = batch_size or config['BATCH_SIZE']
+    now = now or timezone.now()
+    sender = get_reminder_sender()
+
+    reminded = 0
+    for alias in shard_aliases():
+        while True:
+            with transaction.atomic(), transaction.atomic(using=alias):
+                due = list(
+                    Appointment.objects.using(alias)
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .filter(
+                        status='Approved',
+                        reminder_sent_at__isnull=True,
+                        appointment_datetime__gte=now,
+                        appointment_datetime__lt=now + lead_time,
+                    )
+                    .prefetch_related('patient', 'doctor') # Patients and doctors are on 'default'
+                    .order_by('appointment_datetime')[:batch_size]
+                )
+                if not due:
+                    break
+                _send_batch(sender, due, now)
+                Appointment.objects.using(alias).filter(pk__in=[a.pk for a in due]).update(reminder_sent_at=now)
+            reminded += len(due)
+    return reminded
+
+
+def _send_batch(sender, appointments, now):
+    by_user = defaultdict(list)
+    for appointment in appointments:
+        by_user[appointment.patient.user_id].append(appointment)
+
+    conversations = _reminder_conversations(sender, by_user.keys())
+    messages = []
+    for user_id, user_appointments in by_user.items():
+        lines = [
+            f"- {timezone.localtime(a.appointment_datetime):%Y-%m-%d %H:%M} with Dr. {a.doctor.full_name}"
+            for a in user_appointments
+        ]
+        messages.append(Message(
+            conversation_id=conversations[user_id],
+            sender=sender,
+            message="Reminder: you have upcoming appointments:\n" + "\n".join(lines),
+        ))
+    Message.objects.bulk_create(messages)
+    # bulk_create skips auto_now, so bump the conversations for ConversationViewSet's ordering
+    Conversation.objects.filter(id__in=conversations.values()).update(updated_at=now)
+
+
+def _reminder_conversations(sender, user_ids):
+    """Maps each patient user id to its conversation with the sender, creating missing ones."""
+    Participant = Conversation.participants.through
+    conversations = dict(
+        Participant.objects
+        .filter(conversation__participants=sender, user_id__in=user_ids)
+        .exclude(user_id=sender.id)
+        .values_list('user_id', 'conversation_id')
+    )
+    for user_id in user_ids:
+        if user_id not in conversations:
+            conversation = Conversation.objects.create()
+            conversation.participants.set([sender.id, user_id])
+            conversations[user_id] = conversation.id
+    return conversations
@@ -0,0 +1,168 @@
+# core/safety.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET = Path(__file__).resolve().parent / 'data' / 'drug_safety.json'
+# How often the dataset file is checked for changes
+RELOAD_CHECK_SECONDS = 5.0
+
+
+class MultiPatternMatcher:
+    """
+    Aho-Corasick automaton: finds every pattern occurring in a text in a
+    single pass, however many patterns there are. Matches must start and end
+    on word boundaries. Patterns map to a set of labels.
+    """
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]] # (pattern length, labels) ending at each state
+        for pattern, labels in patterns.items():
+            self._add(pattern.lower(), frozenset(labels))
+        self._build_failure_links()
+
+    def _add(self, pattern, labels):
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append((len(pattern), labels))
+
+    def _build_failure_links(self):
+        # Breadth first; states one character deep keep failing to the root
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        """Union of the labels of every whole-word pattern found in `text`."""
+        text = text.lower()
+        found = set()
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, labels in self._output[state]:
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    found |= labels
+        return found
+
+
+class SafetyChecker:
+    """Allergy and interaction screening built from the drug safety dataset."""
+    def __init__(self, dataset):
+        self.drug_classes = {}
+        patterns = {}
+        for name, drug in dataset['drugs'].items():
+            self.drug_classes[f'drug:{name}'] = {f'class:{cls}' for cls in drug.get('classes', [])}
+            for term in [name] + drug.get('aliases', []):
+                patterns.setdefault(term, set()).add(f'drug:{name}')
+            for cls in drug.get('classes', []):
+                patterns.setdefault(cls, set()).add(f'class:{cls}')
+        for term, classes in dataset.get('allergens', {}).items():
+            patterns.setdefault(term, set()).update(f'class:{cls}' for cls in classes)
+        self.matcher = MultiPatternMatcher(patterns)
+
+        self.interactions = []
+        for interaction in dataset.get('interactions', []):
+            pair = [self._concept(name, dataset['drugs']) for name in interaction['between']]
+            self.interactions.append((pair[0], pair[1], interaction))
+
+    @staticmethod
+    def _concept(name, drugs):
+        return f'drug:{name}' if name in drugs else f'class:{name}'
+
+    def concepts(self, text):
+        """Drugs and drug classes mentioned in `text`, with each drug's classes added."""
+        found = self.matcher.find(text or '')
+        for concept in list(found):
+            found |= self.drug_classes.get(concept, set())
+        return found
+
+    def check(self, medication_name, allergies='', medications=''):
+        """Returns a list of warnings for prescribing `medication_name` to this patient."""
+        prescribed = self.concepts(medication_name)
+        if not prescribed:
+            return []
+        warnings = []
+        allergic_to = prescribed & self.concepts(allergies)
+        if allergic_to:
+            warnings.append({
+                'type': 'allergy',
+                'severity': 'major',
+                'message': f"{medication_name} matches the patient's recorded allergies "
+                           f"({', '.join(sorted(c.split(':', 1)[1] for c in allergic_to))}).",
+            })
+        current = self.concepts(medications)
+        for first, second, interaction in self.interactions:
+            if (first in prescribed and second in current) or (second in prescribed and first in current):
+                warnings.append({
+                    'type': 'interaction',
+                    'severity': interaction['severity'],
+                    'message': f"{medication_name} interacts with the patient's current medications "
+                               f"({' + '.join(interaction['between'])}): {interaction['description']}.",
+                })
+        return warnings
+
+
+_checker = None
+_checker_mtime = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_checker():
+    """
+    The process-wide SafetyChecker. The dataset file is re-stat'ed at most
+    every RELOAD_CHECK_SECONDS and the matcher rebuilt when it changes. If
+    the changed file can't be loaded, the last good checker stays in use.
+    """
+    global _checker, _checker_mtime, _checked_at
+    now = time.monotonic()
+    if _checker is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return _checker
+    with _lock:
+        path = getattr(settings, 'DRUG_SAFETY_DATASET', DEFAULT_DATASET)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if _checker is None or mtime != _checker_mtime:
+            try:
+                with open(path, encoding='utf-8') as source:
+                    checker = SafetyChecker(json.load(source))
+            except Exception:
+                if _checker is None:
+                    raise # Nothing to fall back on
+                logger.exception("Failed to reload the drug safety dataset from %s, keeping the previous one", path)
+            else:
+                _checker = checker
+            _checker_mtime = mtime # A broken file is retried once it changes again
+        _checked_at = now
+    return _checker
+
+
+def check_prescription(medication_name, patient):
+    return get_checker().check(medication_name, patient.allergies, patient.medications)
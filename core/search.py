@@ -0,0 +1,117 @@
+# core/search.py
+import math
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+
+from .models import EMR, EMRSearchPosting, LabResult
+from .sharding import FanOutQuery, across_shards
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 40
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has he her his in is it its of on or '
+    'she that the to was were will with'.split()
+)
+# How much a match counts depending on where it is
+FIELD_WEIGHTS = (('diagnosis', 3.0), ('treatment_plan', 2.0))
+LAB_NOTES_WEIGHT = 1.0
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TOKEN_LENGTH]
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def _add_field(weights, text, field_weight):
+    for token, count in Counter(tokenize(text)).items():
+        weights[token] = weights.get(token, 0.0) + field_weight * (1 + math.log(count))
+
+
+def index_emr(emr_id, using=DEFAULT_DB_ALIAS):
+    """
+    Rebuilds the postings of one EMR from its text and its lab results'
+    notes. `using` is the EMR's shard; its postings are stored alongside it.
+    """
+    emr = EMR.objects.using(using).filter(pk=emr_id).first()
+    with transaction.atomic(using=using):
+        EMRSearchPosting.objects.using(using).filter(emr_id=emr_id).delete()
+        if emr is None:
+            return
+        weights = {}
+        for field, field_weight in FIELD_WEIGHTS:
+            _add_field(weights, getattr(emr, field), field_weight)
+        for notes in LabResult.objects.using(using).filter(emr_id=emr_id).values_list('notes', flat=True):
+            _add_field(weights, notes, LAB_NOTES_WEIGHT)
+        EMRSearchPosting.objects.using(using).bulk_create([
+            EMRSearchPosting(token=token, emr_id=emr_id, weight=weight)
+            for token, weight in weights.items()
+        ])
+
+
+def _document_count():
+    # Only feeds the IDF, so a few minutes stale is fine and saves a COUNT(*)
+    total = cache.get('emr_search_document_count')
+    if total is None:
+        total = across_shards(EMR.objects.all()).count()
+        cache.set('emr_search_document_count', total, 600)
+    return total
+
+
+def _document_frequencies(tokens):
+    """
+    The number of EMRs on every shard with a posting for each token. Cached
+    per token like _document_count(), so a common term's postings are
+    counted once every few minutes rather than on every search.
+    """
+    keys = {token: f'emr_search_df:{token}' for token in tokens}
+    cached = cache.get_many(keys.values())
+    frequencies = {token: cached[key] for token, key in keys.items() if key in cached}
+    missing = [token for token in tokens if token not in frequencies]
+    if missing:
+        counted = Counter()
+        postings = EMRSearchPosting.objects.filter(token__in=missing).order_by().values('token').annotate(n=Count('id'))
+        for row in across_shards(postings):
+            counted[row['token']] += row['n']
+        cache.set_many({keys[token]: counted[token] for token in missing}, 600)
+        frequencies.update((token, counted[token]) for token in missing)
+    return frequencies
+
+
+def search_emrs(query, scope):
+    """
+    EMRs in the `scope` queryset matching any token of `query`, as a queryset
+    of {'emr', 'matched', 'score'} rows: most query tokens matched first,
+    then by TF-IDF score. Only the postings of the query tokens are read.
+    A FanOutQuery scope gives a FanOutQuery of rows from every shard.
+    """
+    tokens = sorted(set(tokenize(query)))
+    if not tokens:
+        return EMRSearchPosting.objects.none().values('emr')
+    postings = EMRSearchPosting.objects.filter(token__in=tokens)
+    # Document frequencies are global, whichever shards the scope covers
+    document_frequency = _document_frequencies(tokens)
+    total = max(_document_count(), 1)
+    idf = {token: math.log(1 + total / max(document_frequency[token], 1)) for token in tokens}
+    score = Sum(Case(
+        *[When(token=token, then=F('weight') * Value(idf[token])) for token in tokens],
+        output_field=FloatField(),
+    ))
+    if isinstance(scope, FanOutQuery):
+        return FanOutQuery(_ranked(postings, scope.queryset, score), scope.aliases)
+    return _ranked(postings.using(scope.db), scope, score)
+
+
+def _ranked(postings, scope, score):
+    return (
+        postings.filter(emr__in=scope.order_by().values('pk'))
+        .values('emr')
+        .annotate(matched=Count('id'), score=score)
+        .order_by('-matched', '-score', '-emr')
+    )
@@ -10,36 +10,67 @@ from .models import (
     Appointment,
     Message,
     HealthMetric,
-    Conversation
+    Conversation,
+    AccessLog,
+    AlertRule,
+    MetricAlert
 )
+from .metrics import timed
+
+
+class ModelSerializer(serializers.ModelSerializer):
+    """
+    Base serializer that reports its output time to the request profiler
+    as the 'serializer' phase.
+    """
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+class ShardedModelSerializer(ModelSerializer):
+    """
+    Serializer of a model stored on its patient's shard (core.sharding).
+    The fields that place a row, `shard_key_fields`, can be set on create
+    but not changed on update: that would leave the row on the wrong shard.
+    """
+    shard_key_fields = ('patient',)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if self.instance is not None:
+            for name in self.shard_key_fields:
+                field = self.instance._meta.get_field(name)
+                if name in attrs and getattr(attrs[name], field.target_field.attname) != getattr(self.instance, field.attname):
+                    raise serializers.ValidationError({name: "Can't be changed once the record exists."})
+        return attrs
 
 # Serializer for the base User model (for context in other serializers)
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
 
 # Model Serializers
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(ModelSerializer):
     class Meta:
         model = Patient
         fields = '__all__'
         read_only_fields = ('user', 'patient_id')
         lookup_field = 'patient_id' # Tell DRF to use this for URLs
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(ModelSerializer):
     class Meta:
         model = Doctor
         fields = '__all__'
         read_only_fields = ('user', 'doctor_id')
         lookup_field = 'doctor_id' # Tell DRF to use this for URLs
 
-class EMRSerializer(serializers.ModelSerializer):
+class EMRSerializer(ShardedModelSerializer):
     class Meta:
         model = EMR
         fields = '__all__'
 
-class PrescriptionSerializer(serializers.ModelSerializer):
+class PrescriptionSerializer(ShardedModelSerializer):
     # Explicitly define the patient field to accept the patient_id
     patient = serializers.SlugRelatedField(
         slug_field='patient_id',
@@ -56,12 +87,14 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('doctor', 'doctor_name', 'patient_name')
 
-class LabResultSerializer(serializers.ModelSerializer):
+class LabResultSerializer(ShardedModelSerializer):
+    shard_key_fields = ('emr',)
+
     class Meta:
         model = LabResult
         fields = '__all__'
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(ShardedModelSerializer):
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
     doctor_name = serializers.CharField(source='doctor.full_name', read_only=True)
     class Meta:
@@ -69,7 +102,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'patient', 'patient_name', 'doctor', 'doctor_name', 'appointment_datetime', 'status', 'notes', 'created_at']
         read_only_fields = ('patient',)
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
 
     class Meta:
@@ -78,14 +111,40 @@ class MessageSerializer(serializers.ModelSerializer):
         # ADD 'conversation' TO THE LINE BELOW
         read_only_fields = ['sender', 'conversation']
 
-class HealthMetricSerializer(serializers.ModelSerializer):
+class HealthMetricSerializer(ShardedModelSerializer):
     class Meta:
         model = HealthMetric
         fields = '__all__'
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
 
     class Meta:
         model = Conversation
         fields = ['id', 'participants', 'updated_at']
+
+class AccessLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AccessLog
+        fields = ['event_id', 'user', 'resource_type', 'object_id', 'patient_id', 'action', 'path', 'accessed_at']
+
+class AlertRuleSerializer(ModelSerializer):
+    patient = serializers.SlugRelatedField(
+        slug_field='patient_id',
+        queryset=Patient.objects.all(),
+        required=False,
+        allow_null=True
+    )
+
+    class Meta:
+        model = AlertRule
+        fields = ['id', 'patient', 'metric_type', 'statistic', 'window', 'operator', 'threshold', 'is_active', 'created_by']
+        read_only_fields = ('created_by',)
+
+class MetricAlertSerializer(ModelSerializer):
+    patient_name = serializers.CharField(source='patient.full_name', read_only=True)
+
+    class Meta:
+        model = MetricAlert
+        fields = ['id', 'rule', 'patient', 'patient_name', 'metric_type', 'observed_value', 'message', 'created_at', 'acknowledged_at']
+        read_only_fields = fields
@@ -0,0 +1,399 @@
+# core/sharding.py
+import contextvars
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import chain
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Max
+
+from .metrics import current_profile
+
+# Patient-owned models, stored on the shard of their patient. LabResult and
+# EMRSearchPosting follow their EMR.
+SHARDED_MODELS = frozenset([
+    'core.emr', 'core.prescription', 'core.appointment', 'core.healthmetric',
+    'core.labresult', 'core.emrsearchposting',
+])
+# Search postings are derived data and never looked up by id, so they keep
+# their per-shard auto increment ids
+GLOBAL_ID_MODELS = SHARDED_MODELS - {'core.emrsearchposting'}
+ID_BLOCK_SIZE = 100
+
+
+def shard_aliases():
+    """The database aliases patient data is spread over (PATIENT_SHARDS)."""
+    return list(getattr(settings, 'PATIENT_SHARDS', None) or [DEFAULT_DB_ALIAS])
+
+
+def sharding_enabled():
+    return len(shard_aliases()) > 1
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def aliases_for(model):
+    """Every alias holding rows of `model`."""
+    return shard_aliases() if is_sharded(model) else [DEFAULT_DB_ALIAS]
+
+
+def shard_for(patient_id, aliases=None):
+    """
+    The alias holding `patient_id`'s records. Rendezvous hashing: each alias
+    scores the id and the highest score wins, so adding a shard only moves
+    the patients that now score highest on it.
+    """
+    aliases = aliases or shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    key = str(patient_id).encode('utf-8')
+    return max(aliases, key=lambda alias: hashlib.blake2b(alias.encode('utf-8') + b':' + key, digest_size=8).digest())
+
+
+def patient_id_of(instance):
+    """The patient_id a sharded row is placed by."""
+    if hasattr(instance, 'patient_id'):
+        return instance.patient_id
+    # LabResult and EMRSearchPosting belong to an EMR
+    emr_field = type(instance)._meta.get_field('emr')
+    if emr_field.is_cached(instance):
+        return instance.emr.patient_id
+    return across_shards(apps.get_model('core', 'EMR').objects.filter(pk=instance.emr_id)).get().patient_id
+
+
+class PatientShardRouter:
+    """
+    Routes sharded models to the shard of their patient and everything else
+    to 'default'. Queries on sharded models without an instance to go by
+    must pick their shard with .using(), for_patient() or across_shards().
+    """
+    def _patient_db(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if is_sharded(type(instance)):
+            return instance._state.db or shard_for(patient_id_of(instance))
+        if type(instance)._meta.label_lower == 'core.patient':
+            return shard_for(instance.patient_id) # e.g. patient.emr_set
+        return None
+
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self._patient_db(model, hints)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            instance = hints.get('instance')
+            if instance is not None and isinstance(instance, model):
+                # A saved row is updated where it is, even when its patient
+                # changed or it awaits rebalance_shards; routing it by patient
+                # would insert a second copy on the other shard
+                if instance._state.db and not instance._state.adding:
+                    return instance._state.db
+                return shard_for(patient_id_of(instance))
+            return self._patient_db(model, hints)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Cross-database relations are what sharding is made of
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in shard_aliases():
+            return None
+        # The other shards only get the sharded tables
+        return app_label == 'core' and f'core.{model_name}' in SHARDED_MODELS
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet of the sharded models. create() without .using() saves through
+    the router, so the new row lands on its patient's shard rather than on
+    'default'.
+    """
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True)
+        return obj
+
+
+def for_patient(queryset, patient_id):
+    """`queryset` on the shard of `patient_id`."""
+    return queryset.using(shard_for(patient_id))
+
+
+def across_shards(queryset):
+    """`queryset` over every shard: a FanOutQuery when sharding is on, else itself."""
+    if is_sharded(queryset.model) and sharding_enabled():
+        return FanOutQuery(queryset)
+    return queryset
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=4 * len(shard_aliases()), thread_name_prefix='shard-fan-out'
+            )
+    return _pool
+
+
+def _run_on_shard(fn, alias):
+    # Pool threads keep their connections between calls, so apply CONN_MAX_AGE here
+    connection = connections[alias]
+    connection.close_if_unusable_or_obsolete()
+    # The request profiler's wrapper is installed on the request thread's
+    # connections only; time this thread's queries into the same profile
+    profile = current_profile()
+    if profile is None:
+        return fn(alias)
+    with connection.execute_wrapper(profile.execute_wrapper):
+        return fn(alias)
+
+
+def fan_out(fn, aliases=None):
+    """
+    Calls fn(alias) for every alias in parallel, in the caller's context;
+    returns the results in alias order. Inside a transaction on any of the
+    aliases the calls run one after another on the caller's connections,
+    the only ones that see its uncommitted writes.
+    """
+    aliases = aliases or shard_aliases()
+    if len(aliases) == 1 or any(connections[alias].in_atomic_block for alias in aliases):
+        return [fn(alias) for alias in aliases]
+    pool = _get_pool()
+    futures = [pool.submit(contextvars.copy_context().run, _run_on_shard, fn, alias) for alias in aliases]
+    return [future.result() for future in futures]
+
+
+def _sort_value(row, name):
+    value = row[name] if isinstance(row, dict) else getattr(row, name)
+    return (value is None, value)
+
+
+class FanOutQuery:
+    """
+    Read-only stand-in for a queryset spanning every shard. filter(),
+    order_by() etc. build the per-shard query; evaluating it runs that query
+    on all shards in parallel and merges the results in the query's
+    ordering. Slicing fetches the first `stop` rows of each shard.
+    """
+    def __init__(self, queryset, aliases=None):
+        self.queryset = queryset
+        self.aliases = aliases or shard_aliases()
+        self.model = queryset.model
+
+    def _clone(self, queryset):
+        return FanOutQuery(queryset, self.aliases)
+
+    def all(self):
+        return self
+
+    def none(self):
+        return self.queryset.none()
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.queryset.filter(*args, **kwargs))
+
+    def exclude(self, *args, **kwargs):
+        return self._clone(self.queryset.exclude(*args, **kwargs))
+
+    def order_by(self, *fields):
+        return self._clone(self.queryset.order_by(*fields))
+
+    def prefetch_related(self, *lookups):
+        return self._clone(self.queryset.prefetch_related(*lookups))
+
+    def _ordering(self):
+        query = self.queryset.query
+        if query.order_by:
+            return list(query.order_by)
+        return list(self.model._meta.ordering) if query.default_ordering else []
+
+    def _merge(self, results):
+        rows = list(chain.from_iterable(results))
+        # Each shard's rows arrive sorted, which Timsort merges as runs
+        for field in reversed(self._ordering()):
+            name = field.lstrip('-')
+            if rows and not isinstance(rows[0], dict) and name != 'pk':
+                name = self.model._meta.get_field(name).attname
+            rows.sort(key=lambda row: _sort_value(row, name), reverse=field.startswith('-'))
+        return rows
+
+    def _fetch(self, queryset):
+        return self._merge(fan_out(lambda alias: list(queryset.using(alias)), self.aliases))
+
+    def __iter__(self):
+        return iter(self._fetch(self.queryset))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        if key.stop is None:
+            return self._fetch(self.queryset)[key]
+        return self._fetch(self.queryset[:key.stop])[key]
+
+    def count(self):
+        return sum(fan_out(lambda alias: self.queryset.using(alias).count(), self.aliases))
+
+    def exists(self):
+        return any(fan_out(lambda alias: self.queryset.using(alias).exists(), self.aliases))
+
+    def get(self, *args, **kwargs):
+        queryset = self.queryset.filter(*args, **kwargs)[:2]
+        found = list(chain.from_iterable(fan_out(lambda alias: list(queryset.using(alias)), self.aliases)))
+        if not found:
+            raise self.model.DoesNotExist(f"{self.model._meta.object_name} matching query does not exist.")
+        if len(found) > 1:
+            raise self.model.MultipleObjectsReturned(f"get() returned more than one {self.model._meta.object_name}.")
+        return found[0]
+
+
+@contextmanager
+def atomic_on(*aliases):
+    """One transaction per alias, nested in order, so the last alias commits first."""
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(aliases):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+_id_blocks = {}
+_id_lock = threading.Lock()
+
+
+def _reserve_ids(model, size):
+    ShardSequence = apps.get_model('core', 'ShardSequence')
+    name = model._meta.label_lower
+    if not ShardSequence.objects.filter(name=name).exists():
+        # Start above every id already on any shard, e.g. from before sharding was enabled
+        start = 1 + max(
+            model._base_manager.using(alias).aggregate(top=Max('pk'))['top'] or 0
+            for alias in shard_aliases()
+        )
+        ShardSequence.objects.get_or_create(name=name, defaults={'next_value': start})
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequence = ShardSequence.objects.select_for_update().get(name=name)
+        start = sequence.next_value
+        sequence.next_value += size
+        sequence.save(update_fields=['next_value'])
+    return start
+
+
+def allocate_ids(model, count):
+    """
+    `count` primary keys for new `model` rows that are unique across shards.
+    Ids are reserved from ShardSequence in blocks of ID_BLOCK_SIZE, so most
+    calls don't touch the database; unused ids of a block are skipped.
+    """
+    ids = []
+    with _id_lock:
+        block = _id_blocks.setdefault(model._meta.label_lower, [0, 0]) # [next, end)
+        while len(ids) < count:
+            if block[0] >= block[1]:
+                size = max(ID_BLOCK_SIZE, count - len(ids))
+                block[0] = _reserve_ids(model, size)
+                block[1] = block[0] + size
+            take = min(block[1] - block[0], count - len(ids))
+            ids.extend(range(block[0], block[0] + take))
+            block[0] += take
+    return ids
+
+
+def assign_ids(objs):
+    """Gives unsaved sharded rows global ids before a bulk_create (a no-op without sharding)."""
+    pending = [obj for obj in objs if obj.pk is None]
+    if pending and sharding_enabled() and type(pending[0])._meta.label_lower in GLOBAL_ID_MODELS:
+        for obj, pk in zip(pending, allocate_ids(type(pending[0]), len(pending))):
+            obj.pk = pk
+    return objs
+
+
+def delete_on_other_shards(instance):
+    """
+    Applies on_delete of the sharded models' foreign keys to a Patient or
+    Doctor being deleted. The ORM's collector only looks on 'default'.
+    """
+    if type(instance)._meta.label_lower == 'core.patient':
+        aliases = [shard_for(instance.patient_id)]
+    else:
+        aliases = shard_aliases()
+    for alias in aliases:
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        for label in sorted(SHARDED_MODELS):
+            model = apps.get_model(label)
+            for field in model._meta.fields:
+                if not field.is_relation or field.remote_field.model is not type(instance):
+                    continue
+                queryset = model._base_manager.using(alias).filter(
+                    **{field.attname: getattr(instance, field.target_field.attname)}
+                )
+                if field.remote_field.on_delete is models.SET_NULL:
+                    queryset.update(**{field.attname: None})
+                else:
+                    queryset.delete()
+
+
+def _copy_rows(model, rows, alias):
+    """Inserts rows that keep their ids on `alias`, with their auto_now / auto_now_add values as loaded."""
+    stamped = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    loaded = [[getattr(row, field.attname) for field in stamped] for row in rows]
+    # bulk_create() stamps these fields with the current time
+    model._base_manager.using(alias).bulk_create(rows, ignore_conflicts=True)
+    if stamped and rows:
+        for row, values in zip(rows, loaded):
+            for field, value in zip(stamped, values):
+                setattr(row, field.attname, value)
+        model._base_manager.using(alias).bulk_update(rows, [field.name for field in stamped])
+
+
+def move_patients(patient_ids, source, target):
+    """
+    Moves the records of `patient_ids` from the `source` shard to `target`,
+    keeping their ids, and returns the number of rows moved per model. The
+    copy commits before the delete, so an interrupted move leaves rows on
+    both shards and simply running it again completes it.
+    """
+    from .dashboard import paused
+
+    EMR = apps.get_model('core', 'EMR')
+    moved = {}
+    # The records only change shards, so the doctor dashboard counts stay as they are
+    with paused(), transaction.atomic(using=source), transaction.atomic(using=target):
+        for label in ['core.emr', 'core.prescription', 'core.appointment', 'core.healthmetric']:
+            model = apps.get_model(label)
+            rows = list(model._base_manager.using(source).filter(patient_id__in=patient_ids))
+            _copy_rows(model, rows, target)
+            moved[label] = len(rows)
+        emr_ids = list(EMR._base_manager.using(source).filter(patient_id__in=patient_ids).values_list('pk', flat=True))
+        for label in ['core.labresult', 'core.emrsearchposting']:
+            model = apps.get_model(label)
+            rows = list(model._base_manager.using(source).filter(emr_id__in=emr_ids))
+            if label not in GLOBAL_ID_MODELS:
+                for row in rows:
+                    row.pk = None # Auto increment ids are only unique per shard
+            model._base_manager.using(target).bulk_create(rows, ignore_conflicts=True)
+            moved[label] = len(rows)
+        # Deleting the EMRs takes their lab results and postings with them
+        for label in ['core.emr', 'core.prescription', 'core.appointment', 'core.healthmetric']:
+            apps.get_model(label)._base_manager.using(source).filter(patient_id__in=patient_ids).delete()
+    return moved
@@ -0,0 +1,79 @@
+# core/signals.py
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import dashboard
+from .alerts import evaluate_reading
+from .models import EMR, Appointment, Doctor, HealthMetric, LabResult, Patient, Prescription
+from .search import index_emr
+from .sharding import GLOBAL_ID_MODELS, assign_ids, delete_on_other_shards
+
+
+@receiver(post_save, sender=HealthMetric)
+def check_metric_alerts(sender, instance, created, raw=False, **kwargs):
+    # Only new readings feed the rolling windows; fixtures are skipped
+    if created and not raw:
+        evaluate_reading(instance)
+
+
+@receiver(post_save, sender=EMR)
+def reindex_emr(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_emr(instance.pk, instance._state.db)
+
+
+@receiver(post_save, sender=LabResult)
+def reindex_lab_result_emr(sender, instance, raw=False, **kwargs):
+    # Lab notes are indexed as part of their EMR
+    if not raw:
+        index_emr(instance.emr_id, instance._state.db)
+
+
+@receiver(post_delete, sender=LabResult)
+def reindex_deleted_lab_result_emr(sender, instance, origin=None, **kwargs):
+    # When the EMR itself is being deleted its postings go with it
+    if getattr(origin, 'model', type(origin)) is LabResult:
+        index_emr(instance.emr_id, instance._state.db)
+
+
+def assign_global_id(sender, instance, raw=False, **kwargs):
+    # Rows on different shards must not share an id
+    if not raw:
+        assign_ids([instance])
+
+
+for label in GLOBAL_ID_MODELS:
+    pre_save.connect(assign_global_id, sender=apps.get_model(label))
+
+
+@receiver(pre_delete, sender=Patient)
+def delete_sharded_patient_records(sender, instance, **kwargs):
+    delete_on_other_shards(instance)
+
+
+@receiver(pre_delete, sender=Doctor)
+def delete_sharded_doctor_records(sender, instance, **kwargs):
+    dashboard.doctor_deleting(instance.doctor_id)
+    delete_on_other_shards(instance)
+
+
+@receiver(post_delete, sender=Doctor)
+def forget_deleted_doctor(sender, instance, **kwargs):
+    dashboard.doctor_deleted(instance.doctor_id)
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Prescription)
+@receiver(post_save, sender=EMR)
+def update_doctor_stats(sender, instance, created, raw=False, **kwargs):
+    if not raw and not dashboard.is_paused():
+        dashboard.record_saved(instance, created)
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Prescription)
+@receiver(post_delete, sender=EMR)
+def update_doctor_stats_on_delete(sender, instance, **kwargs):
+    if not dashboard.is_paused():
+        dashboard.record_deleted(instance)
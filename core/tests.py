@@ -1,3 +1,924 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .admin import EstimatedCountPaginator
+from .archive import archive_key
+from .audit import AuditWriter, fcntl
+from .bulk_import import BulkImporter, read_records
+from .export import ndjson_lines
+from .models import (
+    AccessLog, AlertRule, Appointment, Doctor, DoctorPatientLink, DoctorStat, EMR, EMRSearchPosting, HealthMetric,
+    ImportJob, LabResult, Message, MetricAlert, Patient, Prescription,
+)
+from .reminders import get_reminder_sender, send_due_reminders
+from .safety import DEFAULT_DATASET, MultiPatternMatcher, SafetyChecker
+from .metrics import MetricsRegistry, RequestProfile, activate, registry, timed
+from .sharding import SHARDED_MODELS, across_shards, for_patient, move_patients, shard_aliases, shard_for
+
+# Throttle buckets in memory rather than in the shared file cache, a fast
+# password hasher, and no audit writer thread (AuditWriterTests make their own)
+test_settings = override_settings(
+    AUDIT_LOG={**settings.AUDIT_LOG, 'ENABLED': False},
+    CACHES={
+        **settings.CACHES,
+        'throttle': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-throttle'},
+    },
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+
+
+@test_settings
+class ShardedTestCase(TestCase):
+    """
+    Runs on every database alias, so with SQLITE_SHARDS=N the sharded
+    models really are spread over N databases.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        caches['throttle'].clear()
+
+
+def make_patient(name='Pat'):
+    user = User.objects.create_user(username=f'{name.lower()}-{uuid.uuid4().hex[:8]}', password='x-Secret-123')
+    return Patient.objects.create(user=user, full_name=name)
+
+
+def make_doctor(name='Doc'):
+    user = User.objects.create_user(username=f'{name.lower()}-{uuid.uuid4().hex[:8]}', password='x-Secret-123')
+    return Doctor.objects.create(user=user, full_name=name)
+
+
+def access_event():
+    return {
+        'event_id': str(uuid.uuid4()), 'user_id': None, 'resource_type': 'emr', 'object_id': '1',
+        'patient_id': 'P1', 'action': 'list', 'path': '/api/emrs/', 'accessed_at': timezone.now().isoformat(),
+    }
+
+
+class RequestMetricsTests(ShardedTestCase):
+    def phases_of(self, view):
+        _, _, series = registry._metrics['http_request_phase_seconds']
+        return {dict(key)['phase']: histogram.count for key, histogram in series.items() if dict(key)['view'] == view}
+
+    def test_middleware_records_the_phases_a_request_went_through(self):
+        doctor = make_doctor()
+        EMR.objects.create(patient=make_patient(), doctor=doctor, diagnosis='asthma')
+        before = self.phases_of('emr-list')
+        client = APIClient()
+        client.force_authenticate(doctor.user)
+        self.assertEqual(client.get('/api/emrs/').status_code, 200)
+
+        after = self.phases_of('emr-list')
+        self.assertEqual(
+            {phase: count - before.get(phase, 0) for phase, count in after.items()},
+            {'db': 1, 'serializer': 1, 'render': 1},
+        )
+        metrics = client.get('/api/metrics/').content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="emr-list"}', metrics)
+
+    def test_nested_timed_blocks_count_once_and_exclude_queries(self):
+        with activate(RequestProfile()) as profile:
+            with mock.patch('core.metrics.time.perf_counter', side_effect=[0.0, 1.0, 3.0, 5.0]):
+                with timed('serializer'):
+                    with timed('serializer'):
+                        # One query taking 2 of the block's 5 seconds
+                        profile.execute_wrapper(lambda *args: None, 'SELECT 1', None, False, {})
+        self.assertEqual(profile.phases, {'db': 2.0, 'serializer': 3.0})
+        self.assertEqual(profile.queries, 1)
+
+    def test_render_exports_cumulative_prometheus_histograms(self):
+        metrics = MetricsRegistry()
+        metrics.register('request_seconds', 'Time per request.', (0.1, 1.0))
+        metrics.observe('request_seconds', 0.05, view='a"b')
+        metrics.observe('request_seconds', 0.5, view='a"b')
+        metrics.observe('request_seconds', 2.0, view='a"b')
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# HELP request_seconds Time per request.',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'request_seconds_bucket{view="a\\"b",le="1.0"} 2',
+            'request_seconds_bucket{view="a\\"b",le="+Inf"} 3',
+            'request_seconds_sum{view="a\\"b"} 2.55',
+            'request_seconds_count{view="a\\"b"} 3',
+        ]) + '\n')
+
+class AuditWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        self.writer = AuditWriter(self.spool_dir, batch_size=50, flush_interval=0.05, max_queue=5)
+        self.addCleanup(self.writer.stop)
+
+    def spool_size(self):
+        self.writer._spool.flush()
+        return len(open(self.writer._spool.name, encoding='utf-8').read())
+
+    def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            self.writer._stopping.wait(0.05)
+        self.fail("Timed out waiting for the audit writer")
+
+    def test_spooled_events_are_written_once_the_database_recovers(self):
+        write, failing = self.writer._write, [True]
+
+        def flaky_write(events):
+            if failing[0]:
+                raise RuntimeError("database is down")
+            write(events)
+
+        self.writer._write = flaky_write
+        with self.assertLogs('core.audit', 'WARNING'):
+            for _ in range(20): # More than the queue holds
+                self.writer.record(access_event())
+            self.wait_for(lambda: self.writer._queue.empty())
+            self.assertEqual(AccessLog.objects.count(), 0)
+
+            failing[0] = False
+            self.wait_for(lambda: AccessLog.objects.count() == 20 and not self.spool_size())
+            self.assertFalse(self.writer._spool_dirty)
+
+            self.writer.record(access_event())
+            self.wait_for(lambda: AccessLog.objects.count() == 21 and not self.spool_size())
+
+
+    @unittest.skipIf(fcntl is None, "Orphaned spools are only replayed where fcntl is available")
+    def test_torn_orphaned_spool_is_replayed_and_removed(self):
+        orphan = os.path.join(self.spool_dir, 'spool-1-crashed.jsonl')
+        with open(orphan, 'w', encoding='utf-8') as spool:
+            spool.write(json.dumps(access_event()) + '\n' + json.dumps(access_event())[:40])
+        write, calls = self.writer._write, []
+
+        def failing_once(events):
+            calls.append(len(events))
+            if len(calls) == 1:
+                raise RuntimeError("database is down")
+            write(events)
+
+        self.writer._write = failing_once
+        with self.assertLogs('core.audit', 'WARNING'):
+            self.writer.record(access_event())
+            self.wait_for(lambda: AccessLog.objects.count() == 2 and not os.path.exists(orphan))
+        self.assertTrue(self.writer._thread.is_alive())
+        with open(os.path.join(self.spool_dir, 'spool-1-crashed.rejected'), encoding='utf-8') as rejected:
+            self.assertEqual(len(rejected.read().splitlines()), 1)
+
+    def test_events_of_a_request_are_spooled_in_one_write(self):
+        self.writer._ensure_started()
+        with mock.patch.object(self.writer._spool, 'write', wraps=self.writer._spool.write) as spool_write:
+            self.writer.record_many([access_event() for _ in range(3)])
+        spool_write.assert_called_once()
+        self.wait_for(lambda: AccessLog.objects.count() == 3)
+
+class ReminderSenderTests(ShardedTestCase):
+    def test_sender_username_cannot_be_registered(self):
+        response = APIClient().post('/api/register/', {
+            'username': 'Reminders', 'email': 'x@example.com', 'password': 'x-Secret-123',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username__iexact='reminders').exists())
+
+    def test_sender_is_an_inactive_account_without_password(self):
+        sender = get_reminder_sender()
+        self.assertFalse(sender.is_active)
+        self.assertFalse(sender.has_usable_password())
+        self.assertEqual(get_reminder_sender(), sender)
+
+    def test_refuses_a_regular_user_with_the_sender_username(self):
+        User.objects.create_user(username='reminders', password='x-Secret-123')
+        with self.assertRaises(ImproperlyConfigured):
+            get_reminder_sender()
+
+    def test_reminders_are_sent_from_the_system_account(self):
+        patient, doctor = make_patient(), make_doctor()
+        now = timezone.now()
+        Appointment.objects.create(patient=patient, doctor=doctor, status='Approved',
+                                   appointment_datetime=now + timedelta(hours=2))
+        self.assertEqual(send_due_reminders(now=now), 1)
+        self.assertEqual(send_due_reminders(now=now), 0)
+        message = Message.objects.get()
+        self.assertEqual(message.sender, get_reminder_sender())
+        self.assertIn(patient.user, message.conversation.participants.all())
+
+
+class ExportTests(ShardedTestCase):
+    def test_exports_every_row_once_in_chunks(self):
+        doctor = make_doctor()
+        patients = [make_patient(f'P{n}') for n in range(6)]
+        for patient in patients:
+            for _ in range(3):
+                Appointment.objects.create(patient=patient, doctor=doctor, appointment_datetime=timezone.now())
+        rows = [json.loads(line) for line in ndjson_lines('appointments', chunk_size=2)]
+        self.assertEqual(len(rows), 18)
+        self.assertEqual(len({row['id'] for row in rows}), 18)
+
+    def test_since_picks_up_status_changes(self):
+        appointment = Appointment.objects.create(
+            patient=make_patient(), doctor=make_doctor(), appointment_datetime=timezone.now(),
+        )
+        since = timezone.now()
+        self.assertEqual(list(ndjson_lines('appointments', since)), [])
+        appointment.status = 'Approved'
+        appointment.save()
+        rows = [json.loads(line) for line in ndjson_lines('appointments', since)]
+        self.assertEqual([(row['id'], row['status']) for row in rows], [(appointment.pk, 'Approved')])
+
+    def test_since_timestamps_are_indexed_on_every_shard(self):
+        for model, field in [(EMR, 'updated_at'), (Appointment, 'updated_at')]:
+            for alias in shard_aliases():
+                connection = connections[alias]
+                with connection.cursor() as cursor:
+                    constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                self.assertIn([field], [c['columns'] for c in constraints.values() if c['index']], (alias, model))
+
+
+class BulkImportTests(ShardedTestCase):
+    def run_import(self, *lines):
+        path = tempfile.mktemp(suffix='.ndjson')
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        with open(path, 'w', encoding='utf-8') as source:
+            source.write('\n'.join(lines) + '\n')
+        errors = io.StringIO()
+        job = ImportJob.objects.create(name=path)
+        BulkImporter(job, batch_size=2, errors=errors).run(read_records(path, 'ndjson'))
+        return job, [json.loads(line) for line in errors.getvalue().splitlines()]
+
+    def test_rows_that_are_not_objects_are_reported_per_row(self):
+        job, errors = self.run_import(
+            '"garbage"',
+            '[1, 2]',
+            '{"username": 5, "full_name": "Numeric"}',
+            '{"type": "patient", "username": "kept", "full_name": "Kept", "ref": "r1"}',
+            '{"type": "emr", "patient_ref": "r1", "diagnosis": "asthma"}',
+        )
+        self.assertEqual([error['line'] for error in errors], [1, 2, 3])
+        self.assertIsNotNone(job.completed_at)
+        patient = Patient.objects.get(user__username='kept')
+        self.assertEqual(for_patient(EMR.objects.filter(patient=patient), patient.patient_id).count(), 1)
+
+    def test_password_hash_must_be_a_known_hash(self):
+        _, errors = self.run_import(
+            '{"username": "plain", "full_name": "Plain", "password_hash": "hunter2"}',
+            '{"username": "hashed", "full_name": "Hashed", "password_hash": "%s"}' % make_password('x-Secret-123'),
+            '{"username": "nohash", "full_name": "No Hash"}',
+        )
+        self.assertEqual([error['line'] for error in errors], [1])
+        self.assertFalse(User.objects.filter(username='plain').exists())
+        self.assertTrue(User.objects.get(username='hashed').check_password('x-Secret-123'))
+        self.assertFalse(User.objects.get(username='nohash').has_usable_password())
+
+
+    def test_usernames_differing_only_in_case_are_rejected_per_row(self):
+        User.objects.create_user(username='Carol', password='x-Secret-123')
+        with connections['default'].cursor() as cursor:
+            # What a case-insensitive collation such as MySQL's enforces
+            cursor.execute("CREATE UNIQUE INDEX test_username_ci ON auth_user (LOWER(username))")
+        job, errors = self.run_import(
+            '{"username": "Bob", "full_name": "Bob"}',
+            '{"username": "bob", "full_name": "Bob Again"}',
+            '{"username": "carol", "full_name": "Carol"}',
+            '{"username": "dave", "full_name": "Dave"}',
+        )
+        self.assertEqual([error['line'] for error in errors], [2, 3])
+        self.assertIsNotNone(job.completed_at)
+        self.assertEqual(
+            set(Patient.objects.values_list('user__username', flat=True)), {'Bob', 'dave'},
+        )
+
+class ArchiveScrollbackTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        archive = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive, ignore_errors=True)
+        archive_settings = override_settings(ARCHIVE={'DIR': archive, 'SEGMENT_ROWS': 10})
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        self.patient, self.other, self.doctor = make_patient(), make_patient('Other'), make_doctor()
+        for patient in [self.patient, self.other]:
+            HealthMetric.objects.create(patient=patient, metric_type='weight', value='70', unit='kg')
+            archive_key('healthmetric', patient.patient_id, timezone.now() + timedelta(seconds=1), 10)
+
+    def scroll_back(self, user, patient=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        params = {'before': (timezone.now() + timedelta(minutes=1)).isoformat()}
+        if patient:
+            params['patient'] = patient.patient_id
+        response = client.get('/api/healthmetrics/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['patient'] for row in response.data]
+
+    def test_patients_only_read_their_own_archives(self):
+        self.assertEqual(self.scroll_back(self.patient.user, self.patient), [self.patient.patient_id])
+        self.assertEqual(self.scroll_back(self.patient.user, self.other), [])
+
+    def test_doctors_read_archives_of_their_patients(self):
+        self.assertEqual(self.scroll_back(self.doctor.user, self.patient), [])
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, appointment_datetime=timezone.now())
+        self.assertEqual(self.scroll_back(self.doctor.user, self.patient), [self.patient.patient_id])
+
+    def test_hot_rows_follow_the_same_rule(self):
+        for patient in [self.patient, self.other]:
+            HealthMetric.objects.create(patient=patient, metric_type='weight', value='71', unit='kg')
+        self.assertEqual(self.scroll_back(self.patient.user, self.other), [])
+        self.assertEqual(self.scroll_back(self.patient.user), [self.patient.patient_id] * 2)
+        self.assertEqual(self.scroll_back(self.doctor.user), [])
+
+    def test_doctor_access_goes_by_the_records_not_the_summary_table(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctor, appointment_datetime=timezone.now())
+        DoctorPatientLink.objects.all().delete() # e.g. not reconciled after a bulk import
+        DoctorPatientLink.objects.create(doctor=self.doctor, patient_id=self.other.patient_id, records=1)
+        self.assertEqual(self.scroll_back(self.doctor.user), [self.patient.patient_id])
+        self.assertEqual(self.scroll_back(self.doctor.user, self.other), [])
+
+
+class LoginThrottleTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create_user(username='victim', password='x-Secret-123')
+
+    def login(self, username='victim', ip='10.0.0.1', forwarded_for=None, password='wrong'):
+        extra = {'REMOTE_ADDR': ip}
+        if forwarded_for:
+            extra['HTTP_X_FORWARDED_FOR'] = forwarded_for
+        return APIClient().post('/api/token/', {'username': username, 'password': password}, **extra)
+
+    def test_bucket_empties_then_refills(self):
+        with mock.patch('core.throttling.time.time', return_value=1000.0) as clock:
+            self.assertEqual([self.login().status_code for _ in range(10)], [401] * 10)
+            response = self.login()
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '6') # 10/min refills a token every 6 seconds
+            clock.return_value = 1006.0
+            self.assertEqual(self.login().status_code, 401)
+            self.assertEqual(self.login().status_code, 429)
+
+    def test_forwarded_for_does_not_pick_a_fresh_bucket(self):
+        statuses = [self.login(forwarded_for=f'192.0.2.{n}').status_code for n in range(15)]
+        self.assertIn(429, statuses)
+
+    def test_failed_logins_from_one_address_dont_lock_the_account_out(self):
+        with mock.patch('core.throttling.time.time', return_value=1000.0) as clock:
+            statuses = []
+            for _ in range(21):
+                clock.return_value += 6 # Stay within the per-address 10/min
+                statuses.append(self.login(ip='10.6.6.6').status_code)
+            self.assertEqual(statuses, [401] * 20 + [429])
+            self.assertEqual(self.login(ip='10.0.0.1', password='x-Secret-123').status_code, 200)
+
+    def test_successful_logins_take_no_token_from_the_account(self):
+        with mock.patch('core.throttling.time.time', return_value=1000.0) as clock:
+            for _ in range(25):
+                clock.return_value += 6
+                self.assertEqual(self.login(password='x-Secret-123').status_code, 200)
+            self.assertEqual(self.login().status_code, 401)
+
+    def test_one_account_is_limited_from_any_address(self):
+        statuses = [self.login(ip=f'10.0.{n // 250}.{n % 250}').status_code for n in range(105)]
+        self.assertEqual(statuses.count(401), 100)
+        self.assertEqual(self.login('someone-else', ip='10.9.9.9').status_code, 401)
+
+
+class EstimatedCountPaginatorTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        for n in range(3):
+            make_patient(f'P{n}')
+        estimate = mock.patch('core.admin.estimated_row_count', return_value=20000)
+        estimate.start()
+        self.addCleanup(estimate.stop)
+
+    def paginator(self):
+        return EstimatedCountPaginator(Patient.objects.order_by('pk'), 2)
+
+    def test_uses_the_estimate_for_early_pages(self):
+        paginator = self.paginator()
+        self.assertEqual(len(paginator.page(1).object_list), 2)
+        self.assertEqual(paginator.count, 20000)
+
+    def test_over_estimate_is_clamped_to_the_last_page_with_rows(self):
+        for number in [10000, 50]: # The estimated last page, and an empty one
+            paginator = self.paginator()
+            self.assertEqual(paginator.num_pages, 10000)
+            page = paginator.page(number)
+            self.assertEqual((page.number, len(page.object_list)), (2, 1))
+            self.assertEqual((paginator.count, paginator.num_pages), (3, 2))
+
+    def test_small_tables_are_counted_exactly(self):
+        with mock.patch('core.admin.estimated_row_count', return_value=500):
+            self.assertEqual(self.paginator().count, 3)
+
+
+class AlertRuleScopeTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor, self.patient, self.stranger = make_doctor(), make_patient(), make_patient('Stranger')
+        EMR.objects.create(patient=self.patient, doctor=self.doctor, diagnosis='hypertension')
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def create_rule(self, patient):
+        return self.client.post('/api/alert-rules/', {
+            'patient': patient.patient_id if patient else '', 'metric_type': 'bp_systolic',
+            'operator': 'gt', 'threshold': 140,
+        })
+
+    def test_doctors_set_rules_on_their_own_patients_only(self):
+        self.assertEqual(self.create_rule(self.patient).status_code, 201)
+        self.assertEqual(self.create_rule(self.stranger).status_code, 403)
+        rule = AlertRule.objects.get()
+        response = self.client.patch(f'/api/alert-rules/{rule.pk}/', {'patient': self.stranger.patient_id})
+        self.assertEqual(response.status_code, 403)
+
+    def test_only_staff_set_rules_for_every_patient(self):
+        self.assertEqual(self.create_rule(None).status_code, 403)
+        self.doctor.user.is_staff = True
+        self.doctor.user.save()
+        self.assertEqual(self.create_rule(None).status_code, 201)
+        self.assertIsNone(AlertRule.objects.get().patient)
+
+
+    def test_scope_goes_by_the_records_not_the_summary_table(self):
+        DoctorPatientLink.objects.all().delete() # e.g. not reconciled after a bulk import
+        self.assertEqual(self.create_rule(self.patient).status_code, 201)
+
+
+class MetricAlertTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor, self.patient = make_doctor(), make_patient()
+
+    def reading(self, value):
+        HealthMetric.objects.create(patient=self.patient, metric_type='bp_systolic', value=str(value))
+
+    def rule(self, **fields):
+        return AlertRule.objects.create(
+            patient=self.patient, metric_type='bp_systolic', operator='gt', threshold=140,
+            created_by=self.doctor, **fields,
+        )
+
+    def test_readings_before_a_rule_existed_fill_its_window(self):
+        self.reading(150)
+        self.reading(160)
+        self.rule(statistic='mean', window=3)
+        self.reading(170)
+        self.assertEqual(list(MetricAlert.objects.values_list('observed_value', flat=True)), [160.0])
+
+    def test_alerts_go_to_the_treating_doctor_else_the_rules_author(self):
+        self.rule()
+        self.reading(150)
+        treating = make_doctor('Treating')
+        EMR.objects.create(patient=self.patient, doctor=treating, diagnosis='hypertension')
+        self.reading(120)
+        self.reading(150)
+        self.assertEqual(
+            list(MetricAlert.objects.order_by('pk').values_list('doctor_id', flat=True)),
+            [self.doctor.doctor_id, treating.doctor_id],
+        )
+
+    def test_re_enabled_rule_alerts_again(self):
+        rule = self.rule()
+        self.reading(150)
+        rule.is_active = False
+        rule.save()
+        self.reading(120)
+        self.reading(150)
+        rule.is_active = True
+        rule.save()
+        self.reading(150)
+        self.assertEqual(MetricAlert.objects.count(), 2)
+
+class EMRSearchTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear() # Cached document counts
+        self.doctor = make_doctor()
+        if len(shard_aliases()) > 1:
+            self.first, self.second = make_patients_on_two_shards()
+        else:
+            self.first, self.second = make_patient('First'), make_patient('Second')
+
+    def emr(self, patient=None, doctor=None, **fields):
+        return EMR.objects.create(patient=patient or self.first, doctor=doctor or self.doctor, **fields)
+
+    def search(self, query, user=None, **params):
+        client = APIClient()
+        client.force_authenticate(user or self.doctor.user)
+        response = client.get('/api/emrs/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def found(self, query, user=None):
+        return [item['id'] for item in self.search(query, user)['results']]
+
+    def test_ranks_by_tokens_matched_then_field_weight(self):
+        treatment = self.emr(self.second, treatment_plan='Asthma action plan')
+        both = self.emr(diagnosis='asthma with acute bronchitis')
+        diagnosis = self.emr(self.second, diagnosis='Asthma')
+        self.emr(diagnosis='migraine')
+        self.assertEqual(self.found('asthma bronchitis'), [both.pk, diagnosis.pk, treatment.pk])
+
+    def test_only_searches_emrs_the_user_can_see(self):
+        own = self.emr(diagnosis='asthma')
+        other = self.emr(self.second, doctor=make_doctor('Other'), diagnosis='asthma')
+        self.assertEqual(self.found('asthma'), [own.pk])
+        self.assertEqual(self.found('asthma', self.first.user), [own.pk])
+        self.assertEqual(self.found('asthma', self.second.user), [other.pk])
+
+    def test_pages_through_every_shard(self):
+        emrs = {self.emr(patient, diagnosis='asthma').pk for patient in [self.first, self.second] * 13}
+        first_page = self.search('asthma')
+        second_page = self.search('asthma', page=2)
+        self.assertEqual(first_page['count'], 26)
+        self.assertEqual((len(first_page['results']), len(second_page['results'])), (20, 6))
+        self.assertEqual({item['id'] for item in first_page['results'] + second_page['results']}, emrs)
+
+    def test_reindexes_on_emr_and_lab_result_changes(self):
+        emr = self.emr(self.second, diagnosis='asthma')
+        emr.diagnosis = 'copd'
+        emr.save()
+        self.assertEqual((self.found('asthma'), self.found('copd')), ([], [emr.pk]))
+
+        lab_result = LabResult.objects.create(emr=emr, test_name='spirometry', notes='Reduced FEV1')
+        self.assertEqual(self.found('fev1'), [emr.pk])
+        lab_result.delete()
+        self.assertEqual(self.found('fev1'), [])
+
+        alias = emr._state.db
+        emr.delete()
+        self.assertFalse(EMRSearchPosting.objects.using(alias).filter(emr_id=emr.pk).exists())
+
+class SafetyScreeningTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(DEFAULT_DATASET, encoding='utf-8') as source:
+            cls.checker = SafetyChecker(json.load(source))
+
+    def test_matcher_finds_overlapping_whole_word_patterns(self):
+        matcher = MultiPatternMatcher({'he': {'he'}, 'she': {'she'}, 'hers': {'hers'}, 'sulfa drugs': {'sulfa'}})
+        self.assertEqual(matcher.find('Ushers, SHE and hers'), {'she', 'hers'})
+        self.assertEqual(matcher.find('allergic to sulfa drugs.'), {'sulfa'})
+        self.assertEqual(matcher.find('sheer'), set())
+
+    def test_allergy_to_a_drug_class(self):
+        warnings = self.checker.check('Amoxicillin 500mg', allergies='Penicillins (rash)')
+        self.assertEqual([warning['type'] for warning in warnings], ['allergy'])
+
+    def test_interaction_through_a_drug_class_and_brand_name(self):
+        warnings = self.checker.check('Advil', medications='coumadin 5mg daily')
+        self.assertEqual([(warning['type'], warning['severity']) for warning in warnings], [('interaction', 'major')])
+        self.assertEqual(self.checker.check('Advil', medications='vitamin d'), [])
+
+
+class PrescriptionScreeningTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = tempfile.mktemp(suffix='.json')
+        self.addCleanup(lambda: os.path.exists(self.dataset) and os.remove(self.dataset))
+        shutil.copy(DEFAULT_DATASET, self.dataset)
+        dataset_settings = override_settings(DRUG_SAFETY_DATASET=self.dataset)
+        dataset_settings.enable()
+        self.addCleanup(dataset_settings.disable)
+        # A fresh checker per test, and a dataset re-stat on every request
+        checker = mock.patch.multiple('core.safety', _checker=None, _checker_mtime=None, RELOAD_CHECK_SECONDS=0)
+        checker.start()
+        self.addCleanup(checker.stop)
+        self.doctor = make_doctor()
+        self.patient = make_patient()
+        self.patient.medications = 'warfarin'
+        self.patient.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def prescribe(self, medication):
+        return self.client.post('/api/prescriptions/', {'patient': self.patient.patient_id, 'medication_name': medication})
+
+    def prescriptions(self):
+        return for_patient(Prescription.objects.all(), self.patient.patient_id).count()
+
+    def break_dataset(self):
+        with open(self.dataset, 'w', encoding='utf-8') as dataset:
+            dataset.write('{not json')
+        os.utime(self.dataset, (0, 0))
+
+    def test_warnings_are_returned_with_the_prescription(self):
+        response = self.prescribe('ibuprofen')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([warning['type'] for warning in response.data['safety_warnings']], ['interaction'])
+        self.assertEqual(self.prescriptions(), 1)
+
+    def test_a_broken_reload_keeps_the_last_good_dataset(self):
+        self.assertEqual(self.prescribe('ibuprofen').status_code, 201)
+        self.break_dataset()
+        with self.assertLogs('core.safety', 'ERROR'):
+            response = self.prescribe('ibuprofen')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['safety_warnings']), 1)
+        self.assertEqual(self.prescriptions(), 2)
+
+    def test_a_failed_screen_saves_nothing(self):
+        self.break_dataset()
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(self.doctor.user)
+        response = client.post('/api/prescriptions/', {'patient': self.patient.patient_id, 'medication_name': 'ibuprofen'})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.prescriptions(), 0)
+
+
+class ShardSchemaTests(ShardedTestCase):
+    def test_sharded_tables_have_no_constraints_to_tables_on_default(self):
+        for alias in shard_aliases():
+            connection = connections[alias]
+            with connection.cursor() as cursor:
+                for label in SHARDED_MODELS:
+                    table = apps.get_model(label)._meta.db_table
+                    references = [
+                        constraint['foreign_key'][0]
+                        for constraint in connection.introspection.get_constraints(cursor, table).values()
+                        if constraint['foreign_key']
+                    ]
+                    self.assertFalse({'core_patient', 'core_doctor'} & set(references), (alias, table))
+
+
+def make_patients_on_two_shards():
+    """Two patients whose records live on different shards."""
+    first = make_patient('First')
+    while True:
+        second = make_patient('Second')
+        if shard_for(second.patient_id) != shard_for(first.patient_id):
+            return first, second
+
+
+def make_patients_for(alias, count=8):
+    """`count` patients, at least one of them placed on `alias`."""
+    patients = [make_patient(f'P{n}') for n in range(count - 1)]
+    while True:
+        patient = make_patient('Last')
+        if shard_for(patient.patient_id) == alias or any(shard_for(p.patient_id) == alias for p in patients):
+            return patients + [patient]
+
+
+def copies_of(instance):
+    """The aliases holding a row with `instance`'s model and primary key."""
+    model = type(instance)
+    return [alias for alias in shard_aliases() if model.objects.using(alias).filter(pk=instance.pk).exists()]
+
+
+class ShardRoutingTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        if len(shard_aliases()) < 2:
+            self.skipTest("Needs SQLITE_SHARDS=2 or more")
+        self.first, self.second = make_patients_on_two_shards()
+        self.doctor = make_doctor()
+
+    def test_rows_are_created_on_their_patients_shard(self):
+        emr = EMR.objects.create(patient=self.first, doctor=self.doctor, diagnosis='asthma')
+        metric = HealthMetric.objects.create(patient=self.second, metric_type='weight', value='70')
+        self.assertEqual(copies_of(emr), [shard_for(self.first.patient_id)])
+        self.assertEqual(copies_of(metric), [shard_for(self.second.patient_id)])
+
+    def test_saving_a_row_updates_it_where_it_is(self):
+        emr = EMR.objects.create(patient=self.first, doctor=self.doctor, diagnosis='asthma')
+        emr = for_patient(EMR.objects.all(), self.first.patient_id).get(pk=emr.pk)
+        emr.patient = self.second
+        emr.save()
+        self.assertEqual(copies_of(emr), [shard_for(self.first.patient_id)])
+
+    def test_patient_of_a_record_cant_be_changed_through_the_api(self):
+        emr = EMR.objects.create(patient=self.first, doctor=self.doctor, diagnosis='asthma')
+        client = APIClient()
+        client.force_authenticate(self.first.user)
+        response = client.patch(f'/api/emrs/{emr.pk}/', {'patient': self.second.patient_id})
+        self.assertEqual(response.status_code, 400)
+        response = client.patch(f'/api/emrs/{emr.pk}/', {'patient': self.first.patient_id, 'diagnosis': 'copd'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(copies_of(emr), [shard_for(self.first.patient_id)])
+        self.assertEqual(EMR.objects.using(copies_of(emr)[0]).get(pk=emr.pk).diagnosis, 'copd')
+
+
+class ShardMoveTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        if len(shard_aliases()) < 2:
+            self.skipTest("Needs SQLITE_SHARDS=2 or more")
+        self.doctor = make_doctor()
+
+    def make_records(self, patient):
+        emr = EMR.objects.create(patient=patient, doctor=self.doctor, diagnosis='asthma')
+        return [
+            emr,
+            LabResult.objects.create(emr=emr, test_name='spirometry'),
+            Prescription.objects.create(patient=patient, doctor=self.doctor, medication_name='salbutamol'),
+            Appointment.objects.create(patient=patient, doctor=self.doctor, appointment_datetime=timezone.now()),
+            HealthMetric.objects.create(patient=patient, metric_type='weight', value='70'),
+        ]
+
+    def test_moved_rows_keep_their_ids_and_timestamps(self):
+        patient = make_patient()
+        source = shard_for(patient.patient_id)
+        target = next(alias for alias in shard_aliases() if alias != source)
+        records = self.make_records(patient)
+        last_year = timezone.now() - timedelta(days=365)
+        EMR.objects.using(source).update(created_at=last_year, updated_at=last_year)
+        Appointment.objects.using(source).update(created_at=last_year, updated_at=last_year)
+
+        moved = move_patients([patient.patient_id], source, target)
+        self.assertEqual(moved['core.emr'], 1)
+        for record in records:
+            self.assertEqual(copies_of(record), [target], type(record).__name__)
+        emr = EMR.objects.using(target).get(pk=records[0].pk)
+        self.assertEqual((emr.created_at, emr.updated_at), (last_year, last_year))
+        appointment = Appointment.objects.using(target).get(pk=records[3].pk)
+        self.assertEqual((appointment.created_at, appointment.updated_at), (last_year, last_year))
+        self.assertEqual(Prescription.objects.using(target).get(pk=records[2].pk).created_at, records[2].created_at)
+
+    def test_rebalance_moves_records_onto_an_added_shard(self):
+        patients = make_patients_for(shard_aliases()[-1])
+        with override_settings(PATIENT_SHARDS=shard_aliases()[:-1]):
+            records = [record for patient in patients for record in self.make_records(patient)]
+
+        call_command('rebalance_shards', stdout=io.StringIO())
+        for record in records:
+            patient_id = (record.emr if isinstance(record, LabResult) else record).patient_id
+            self.assertEqual(copies_of(record), [shard_for(patient_id)], type(record).__name__)
+
+
+class ShardedAdminTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        if len(shard_aliases()) < 2:
+            self.skipTest("Needs SQLITE_SHARDS=2 or more")
+        doctor = make_doctor()
+        self.emrs = {}
+        for patient in make_patients_on_two_shards():
+            emr = EMR.objects.create(patient=patient, doctor=doctor, diagnosis=f'asthma {patient.patient_id}')
+            self.emrs[shard_for(patient.patient_id)] = emr
+        self.client.force_login(User.objects.create_superuser('admin', password='x-Secret-123'))
+
+    def test_changelist_lists_the_picked_shard(self):
+        for alias, emr in self.emrs.items():
+            response = self.client.get('/admin/core/emr/', {'shard': alias})
+            self.assertEqual([row.pk for row in response.context['cl'].result_list], [emr.pk])
+            self.assertContains(response, emr.patient.full_name)
+
+    def test_change_view_finds_rows_on_any_shard(self):
+        for alias, emr in self.emrs.items():
+            lab_result = LabResult.objects.create(emr=emr, test_name='spirometry')
+            response = self.client.get(f'/admin/core/emr/{emr.pk}/change/')
+            self.assertContains(response, emr.diagnosis)
+
+            response = self.client.post(f'/admin/core/labresult/{lab_result.pk}/change/', {
+                'emr': emr.pk, 'test_name': 'peak flow', 'test_date': '', 'result_file_path': '', 'notes': '',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(copies_of(lab_result), [alias])
+            self.assertEqual(LabResult.objects.using(alias).get(pk=lab_result.pk).test_name, 'peak flow')
+
+class DoctorStatsTests(ShardedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = make_doctor()
+        if len(shard_aliases()) > 1:
+            self.first, self.second = make_patients_on_two_shards()
+        else:
+            self.first, self.second = make_patient('First'), make_patient('Second')
+        self.client = APIClient()
+        self.client.force_authenticate(self.doctor.user)
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_doctor_stats', *args, stdout=out)
+        return out.getvalue()
+
+    def assertStatsMatch(self):
+        self.assertIn("Doctor stats match the raw records.", self.reconcile())
+
+    def dashboard(self):
+        response = self.client.get('/api/doctor/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def reload(self, instance):
+        return for_patient(type(instance).objects.all(), instance.patient_id).get(pk=instance.pk)
+
+    def test_summary_tables_follow_record_changes(self):
+        now = timezone.now()
+        requested = Appointment.objects.create(patient=self.first, doctor=self.doctor, appointment_datetime=now)
+        approved = Appointment.objects.create(patient=self.second, doctor=self.doctor, appointment_datetime=now)
+        moved = Appointment.objects.create(patient=self.second, doctor=self.doctor, appointment_datetime=now)
+        prescription = Prescription.objects.create(patient=self.first, doctor=self.doctor, medication_name='a')
+        Prescription.objects.create(patient=self.second, doctor=self.doctor, medication_name='b')
+        emr = EMR.objects.create(patient=self.second, doctor=self.doctor, diagnosis='asthma')
+        self.assertStatsMatch()
+
+        approved = self.reload(approved)
+        approved.status = 'Approved'
+        approved.save()
+        moved = self.reload(moved)
+        moved.status, moved.appointment_datetime = 'Rescheduled', now + timedelta(days=1)
+        moved.save()
+        self.reload(prescription).delete()
+        self.assertStatsMatch()
+        data = self.dashboard()
+        self.assertEqual(data['appointments_today'], {'Requested': 1, 'Approved': 1, 'Rescheduled': 0, 'Cancelled': 0})
+        self.assertEqual((data['pending_requests'], data['prescriptions_this_week']), (1, 1))
+        self.assertEqual(data['active_patients'], 2)
+
+        # The first patient's last record goes, and with it the patient
+        self.reload(requested).delete()
+        self.reload(emr).delete()
+        self.assertStatsMatch()
+        data = self.dashboard()
+        self.assertEqual((data['pending_requests'], data['active_patients']), (0, 1))
+
+    def test_moves_leave_the_summary_tables_as_they_are(self):
+        if len(shard_aliases()) < 2:
+            self.skipTest("Needs SQLITE_SHARDS=2 or more")
+        patients = make_patients_for(shard_aliases()[-1])
+        with override_settings(PATIENT_SHARDS=shard_aliases()[:-1]):
+            with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=3)):
+                for patient in patients:
+                    Prescription.objects.create(patient=patient, doctor=self.doctor, medication_name='a')
+                    Appointment.objects.create(patient=patient, doctor=self.doctor, appointment_datetime=timezone.now())
+        self.assertStatsMatch()
+
+        source = shard_for(self.first.patient_id)
+        EMR.objects.create(patient=self.first, doctor=self.doctor, diagnosis='asthma')
+        move_patients([self.first.patient_id], source, next(a for a in shard_aliases() if a != source))
+        self.assertStatsMatch()
+        call_command('rebalance_shards', stdout=io.StringIO())
+        self.assertStatsMatch()
+        data = self.dashboard()
+        self.assertEqual((data['prescriptions_this_week'], data['pending_requests']), (8, 8))
+        self.assertEqual(data['active_patients'], 9)
+
+    def test_reconcile_fix_rebuilds_drifted_stats(self):
+        Appointment.objects.create(patient=self.first, doctor=self.doctor, appointment_datetime=timezone.now())
+        Prescription.objects.create(patient=self.first, doctor=self.doctor, medication_name='a')
+        # bulk_create() skips the signals, as the bulk importer does
+        Prescription.objects.bulk_create([
+            Prescription(patient=self.second, doctor=self.doctor, medication_name='b'),
+        ])
+        DoctorStat.objects.filter(doctor=self.doctor).update(pending_requests=5)
+        self.assertIn("differ; run with --fix", self.reconcile())
+
+        self.assertIn("Rebuilt the stats of 1 doctor(s).", self.reconcile('--fix'))
+        self.assertStatsMatch()
+        data = self.dashboard()
+        self.assertEqual((data['pending_requests'], data['prescriptions_this_week']), (1, 2))
+        self.assertEqual(data['active_patients'], 2)
+
+
+@test_settings
+class FanOutTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        if len(shard_aliases()) < 2:
+            self.skipTest("Needs SQLITE_SHARDS=2 or more")
+        self.doctor = make_doctor()
+        self.patients = [make_patient(f'P{n}') for n in range(8)]
+        for n, patient in enumerate(self.patients):
+            Prescription.objects.create(patient=patient, doctor=self.doctor, medication_name=f'drug {n}')
+
+    def test_merges_every_shard_in_order(self):
+        prescriptions = across_shards(Prescription.objects.filter(doctor=self.doctor).order_by('-medication_name'))
+        names = [prescription.medication_name for prescription in prescriptions]
+        self.assertEqual(names, [f'drug {n}' for n in reversed(range(8))])
+        self.assertEqual([p.medication_name for p in prescriptions[:3]], names[:3])
+        self.assertEqual(prescriptions.count(), 8)
+
+    def test_queries_on_pool_threads_are_profiled(self):
+        with activate(RequestProfile()) as profile:
+            self.assertEqual(len(list(across_shards(Prescription.objects.all()))), 8)
+        self.assertEqual(profile.queries, len(shard_aliases()))
+        self.assertGreater(profile.phases['db'], 0)
+
+    def test_sees_the_callers_uncommitted_rows(self):
+        with transaction.atomic(), transaction.atomic(using=shard_for(self.patients[0].patient_id)):
+            Prescription.objects.create(patient=self.patients[0], doctor=self.doctor, medication_name='new')
+            self.assertEqual(across_shards(Prescription.objects.all()).count(), 9)
@@ -0,0 +1,142 @@
+# core/throttling.py
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'10/min' -> (capacity 10, refill 10/60 tokens per second)."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def request_role(request):
+    user = request.user
+    if not user or not user.is_authenticated:
+        return 'anon'
+    if hasattr(user, 'doctor'):
+        return 'doctor'
+    if hasattr(user, 'patient'):
+        return 'patient'
+    return 'user'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle whose state lives in a shared cache, so the limit
+    holds across worker processes.
+
+    The rate for `scope` comes from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'],
+    either as 'N/period' or as a dict of such rates keyed by role ('anon',
+    'patient', 'doctor', 'user'). A bucket holds up to N tokens and refills
+    at N per period. Each request costs one cache get and one cache set. The
+    read-modify-write is not atomic, so concurrent bursts may let a request
+    or two more through than the rate allows.
+
+    Requests are bucketed by client IP unless get_ident_key() is overridden.
+    The IP honours X-Forwarded-For only as far as REST_FRAMEWORK['NUM_PROXIES']
+    allows, so clients can't pick a fresh bucket per request.
+    """
+    scope = None
+    cache_alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', 'throttle')
+
+    def get_ident_key(self, request):
+        return f"ip:{self.get_ident(request)}"
+
+    def get_rate(self, request):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if isinstance(rate, dict):
+            rate = rate.get(request_role(request))
+        return parse_rate(rate) if rate else None
+
+    def allow_request(self, request, view):
+        return self.take_token(request)
+
+    def take_token(self, request, peek=False):
+        """Takes a token from the request's bucket, or with `peek` only checks there is one."""
+        rate = self.get_rate(request)
+        if rate is None:
+            return True
+        capacity, refill = rate
+        cache = caches[self.cache_alias]
+        key = f"throttle:{self.scope}:{self.get_ident_key(request)}"
+        now = time.time()
+
+        tokens, updated_at = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated_at) * refill)
+        if tokens < 1:
+            self._wait = (1 - tokens) / refill
+            return False
+        if peek:
+            return True
+        # Keep the entry until the bucket would have refilled anyway
+        cache.set(key, (tokens - 1, now), timeout=int(capacity / refill) + 1)
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Buckets by user, or by client IP for anonymous requests."""
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        return super().get_ident_key(request)
+
+
+class LoginRateThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class FailedLoginThrottle(TokenBucketThrottle):
+    """
+    Only failed logins take a token: the login view charges them with
+    record_failure(). Attempts are refused while the bucket is empty, so a
+    user's successful logins never count against their account.
+    """
+    def allow_request(self, request, view):
+        return self.take_token(request, peek=True)
+
+    def record_failure(self, request):
+        self.take_token(request)
+
+    def get_username_key(self, request):
+        data = request.data if isinstance(request.data, dict) else {}
+        username = str(data.get('username', ''))
+        return f"username:{hashlib.sha256(username.encode('utf-8')).hexdigest()}" # Safe as a cache key
+
+
+class LoginUsernameRateThrottle(FailedLoginThrottle):
+    """Buckets failed logins by username and client IP."""
+    scope = 'login_username'
+
+    def get_ident_key(self, request):
+        return f"{self.get_username_key(request)}:{super().get_ident_key(request)}"
+
+
+class LoginAccountRateThrottle(FailedLoginThrottle):
+    """
+    Buckets failed logins by username from any address. Its rate is well
+    above login_username's, so that guessing from many addresses is capped
+    without anyone locking an account out from a single one.
+    """
+    scope = 'login_account'
+
+    def get_ident_key(self, request):
+        return self.get_username_key(request)
+
+
+class RegisterRateThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class PrescriptionDownloadRateThrottle(UserTokenBucketThrottle):
+    scope = 'prescription_pdf'
@@ -15,7 +15,13 @@ from .views import (
     MessageListView,
     download_prescription_pdf,
     UserProfileView,
-    PatientListViewForDoctors
+    PatientListViewForDoctors,
+    DoctorDashboardView,
+    metrics_view,
+    AccessLogListView,
+    BulkExportView,
+    AlertRuleViewSet,
+    MetricAlertViewSet
 )
 
 # The router automatically generates URL patterns for ViewSets.
@@ -28,6 +34,8 @@ router.register(r'prescriptions', PrescriptionViewSet, basename='prescription')
 router.register(r'healthmetrics', HealthMetricViewSet, basename='healthmetric')
 # Register the new ConversationViewSet
 router.register(r'conversations', ConversationViewSet, basename='conversation')
+router.register(r'alert-rules', AlertRuleViewSet, basename='alert-rule')
+router.register(r'alerts', MetricAlertViewSet, basename='alert')
 
 
 # The urlpatterns list routes URLs to views.
@@ -39,8 +47,12 @@ urlpatterns = [
     path('profiles/patient/', PatientProfileCreateView.as_view(), name='create-patient-profile'),
     path('profiles/doctor/', DoctorProfileCreateView.as_view(), name='create-doctor-profile'),
     path('doctor/patients/', PatientListViewForDoctors.as_view(), name='doctor-patient-list'),
+    path('doctor/dashboard/', DoctorDashboardView.as_view(), name='doctor-dashboard'),
     # URLs from the router and other features
     path('', include(router.urls)),
     path('conversations/<int:conversation_id>/messages/', MessageListView.as_view(), name='conversation-messages'),
     path('prescriptions/<int:prescription_id>/download/', download_prescription_pdf, name='download-prescription'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('audit/access-log/', AccessLogListView.as_view(), name='access-log'),
+    path('export/<str:resource>/', BulkExportView.as_view(), name='bulk-export'),
 ]
\ No newline at end of file
@@ -2,31 +2,63 @@
 from rest_framework import status, viewsets, generics
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.models import User
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import Prescription
 from rest_framework.views import APIView
 from .permissions import IsDoctorUser
+from .metrics import profiling_settings, registry, timed
+from .audit import AuditedReadMixin, query_access_log, record_access, record_event
+from .export import EXPORT_RESOURCES, gzip_stream, ndjson_lines
+from .archive import ArchiveScrollbackMixin
+from .throttling import (
+    FailedLoginThrottle, LoginAccountRateThrottle, LoginRateThrottle, LoginUsernameRateThrottle,
+    PrescriptionDownloadRateThrottle, RegisterRateThrottle,
+)
+from .search import search_emrs
+from .safety import check_prescription
+from .sharding import across_shards, for_patient
+from .dashboard import doctor_dashboard
+from .reminders import is_reserved_username
 import io
 
 # Import your models, serializers, and new permissions
 from .models import (
-    Patient, Doctor, EMR, Prescription, LabResult, Appointment, Message, HealthMetric, Conversation
+    Patient, Doctor, EMR, Prescription, LabResult, Appointment, Message, HealthMetric, Conversation,
+    AlertRule, MetricAlert
 )
 from .serializers import (
     PatientSerializer, DoctorSerializer, EMRSerializer, PrescriptionSerializer,
-    LabResultSerializer, AppointmentSerializer, MessageSerializer, HealthMetricSerializer, ConversationSerializer
+    LabResultSerializer, AppointmentSerializer, MessageSerializer, HealthMetricSerializer, ConversationSerializer,
+    AccessLogSerializer, AlertRuleSerializer, MetricAlertSerializer
 )
-from .permissions import IsPatientOwner, IsDoctorOrReadOnly, IsRelatedPatientOrDoctor
+from .permissions import IsPatientOwner, IsDoctorOrReadOnly, IsRelatedPatientOrDoctor, treated_patient_ids, treats_patient
 
 # --- Authentication and Profile Creation Views ---
 
+class LoginView(TokenObtainPairView):
+    """JWT login. Failed attempts are charged to the failed-login buckets."""
+    throttle_classes = [LoginRateThrottle, LoginUsernameRateThrottle, LoginAccountRateThrottle]
+
+    def post(self, request, *args, **kwargs):
+        from rest_framework.exceptions import AuthenticationFailed
+        try:
+            return super().post(request, *args, **kwargs)
+        except AuthenticationFailed:
+            for throttle in self.get_throttles():
+                if isinstance(throttle, FailedLoginThrottle):
+                    throttle.record_failure(request)
+            raise
+
 class RegisterUserView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterRateThrottle] # Password hashing is expensive
     def post(self, request, *args, **kwargs):
         # ... (This view remains the same as before)
         username = request.data.get('username')
@@ -36,7 +68,7 @@ class RegisterUserView(APIView):
         if not username or not email or not password:
             return Response({"error": "All fields are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if User.objects.filter(username=username).exists():
+        if is_reserved_username(username) or User.objects.filter(username=username).exists():
             return Response({"error": "Username already exists"}, status=status.HTTP_400_BAD_REQUEST)
 
         user = User.objects.create_user(username=username, email=email, password=password)
@@ -79,8 +111,9 @@ class DoctorProfileCreateView(generics.CreateAPIView):
 
 # --- Updated Model ViewSets with Logic and Permissions ---
 
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(AuditedReadMixin, viewsets.ModelViewSet):
     serializer_class = PatientSerializer
+    audit_resource = 'patient'
     permission_classes = [IsAuthenticated, IsPatientOwner]
     lookup_field = 'patient_id' # Important!
 
@@ -107,9 +140,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         # Return appointments relevant to the logged-in user
         user = self.request.user
         if hasattr(user, 'patient'):
-            return Appointment.objects.filter(patient=user.patient)
+            return for_patient(Appointment.objects.filter(patient=user.patient), user.patient.patient_id)
         if hasattr(user, 'doctor'):
-            return Appointment.objects.filter(doctor=user.doctor)
+            # A doctor's patients are on every shard
+            return across_shards(Appointment.objects.filter(doctor=user.doctor))
         return Appointment.objects.none() # No profile, no appointments
 
     def perform_create(self, serializer):
@@ -120,17 +154,21 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("Only patients can create appointments.")
 
+class EMRSearchPagination(PageNumberPagination):
+    page_size = 20
+
 # Similar logic for EMRs, Prescriptions, etc.
-class EMRViewSet(viewsets.ModelViewSet):
+class EMRViewSet(AuditedReadMixin, viewsets.ModelViewSet):
     serializer_class = EMRSerializer
+    audit_resource = 'emr'
     permission_classes = [IsAuthenticated, IsRelatedPatientOrDoctor]
 
     def get_queryset(self):
         user = self.request.user
         if hasattr(user, 'patient'):
-            return EMR.objects.filter(patient=user.patient)
+            return for_patient(EMR.objects.filter(patient=user.patient), user.patient.patient_id)
         if hasattr(user, 'doctor'):
-            return EMR.objects.filter(doctor=user.doctor)
+            return across_shards(EMR.objects.filter(doctor=user.doctor))
         return EMR.objects.none()
 
     def perform_create(self, serializer):
@@ -141,48 +179,100 @@ class EMRViewSet(viewsets.ModelViewSet):
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("Only doctors can create EMRs.")
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Ranked full-text search over diagnoses, treatment plans and lab notes
+        of the EMRs the user can see: ?q=<words>&page=N.
+        """
+        query = request.query_params.get('q', '')
+        if not query.strip():
+            from rest_framework.exceptions import ValidationError
+            raise ValidationError("'q' is required.")
+        paginator = EMRSearchPagination()
+        page = paginator.paginate_queryset(search_emrs(query, self.get_queryset()), request, view=self)
+        emrs = {emr.pk: emr for emr in across_shards(EMR.objects.filter(pk__in=[row['emr'] for row in page]))}
+        ranked = [emrs[row['emr']] for row in page if row['emr'] in emrs]
+        data = self.get_serializer(ranked, many=True).data
+        for item, row in zip(data, page):
+            item['score'] = row['score']
+        return paginator.get_paginated_response(data)
+
 # ... And so on for other models ...
-class PrescriptionViewSet(viewsets.ModelViewSet):
+class PrescriptionViewSet(AuditedReadMixin, viewsets.ModelViewSet):
     serializer_class = PrescriptionSerializer
+    audit_resource = 'prescription'
     permission_classes = [IsAuthenticated] # We will handle permissions in get_queryset
 
     def get_queryset(self):
         user = self.request.user
         if hasattr(user, 'patient'):
-            return Prescription.objects.filter(patient=user.patient).order_by('-created_at')
+            return for_patient(
+                Prescription.objects.filter(patient=user.patient).order_by('-created_at'), user.patient.patient_id
+            )
         if hasattr(user, 'doctor'):
-            return Prescription.objects.filter(doctor=user.doctor).order_by('-created_at')
+            return across_shards(Prescription.objects.filter(doctor=user.doctor).order_by('-created_at'))
         return Prescription.objects.none()
 
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        # Safety warnings don't block the prescription, they're returned with it
+        response.data['safety_warnings'] = self.safety_warnings
+        return response
+
     def perform_create(self, serializer):
         if not hasattr(self.request.user, 'doctor'):
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied("Only doctors can create prescriptions.")
+        # Screened before saving, so a failed screen never leaves a prescription behind
+        self.safety_warnings = check_prescription(
+            serializer.validated_data['medication_name'], serializer.validated_data['patient']
+        )
         # Automatically assign the logged-in doctor
         serializer.save(doctor=self.request.user.doctor)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([PrescriptionDownloadRateThrottle])
 def download_prescription_pdf(request, prescription_id):
     # Security check: Ensure the user (patient) has access to this prescription
     user = request.user
     try:
-        prescription = Prescription.objects.get(id=prescription_id)
+        prescription = across_shards(Prescription.objects.all()).get(id=prescription_id)
         # Check if the user is the patient for this prescription
-        if not hasattr(user, 'patient') or prescription.emr.patient != user.patient:
+        if not hasattr(user, 'patient') or prescription.patient_id != user.patient.patient_id:
             return HttpResponse("Unauthorized", status=403)
     except Prescription.DoesNotExist:
         return HttpResponse("Not Found", status=404)
+    record_access(request, 'prescription', [prescription], 'download')
 
     # Create a file-like buffer to receive PDF data.
     buffer = io.BytesIO()
+    with timed('pdf'):
+        _draw_prescription(buffer, prescription)
+
+    # FileResponse sets the Content-Disposition header so that browsers
+    # present the option to save the file.
+    buffer.seek(0)
+    response = HttpResponse(buffer, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="prescription_{prescription.id}.pdf"'
+    return response
+
+def _draw_prescription(buffer, prescription):
+    # ReportLab takes longer to import than the rest of this module, so only
+    # processes that actually render a PDF pay for it
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
 
     # Create the PDF object, using the buffer as its "file."
     p = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
 
     # Draw things on the PDF.
-    p.drawString(inch, height - inch, f"Prescription for: {prescription.emr.patient.full_name}")
-    p.drawString(inch, height - 1.25 * inch, f"Prescribed by: Dr. {prescription.emr.doctor.full_name}")
-    p.drawString(inch, height - 1.5 * inch, f"Date: {prescription.refill_date or 'N/A'}")
+    p.drawString(inch, height - inch, f"Prescription for: {prescription.patient.full_name}")
+    p.drawString(inch, height - 1.25 * inch, f"Prescribed by: Dr. {prescription.doctor.full_name}")
+    p.drawString(inch, height - 1.5 * inch, f"Date: {prescription.created_at:%Y-%m-%d}")
     p.line(inch, height - 1.6 * inch, width - inch, height - 1.6 * inch)
 
     p.drawString(inch, height - 2 * inch, f"Medication: {prescription.medication_name}")
@@ -193,12 +283,14 @@ def download_prescription_pdf(request, prescription_id):
     p.showPage()
     p.save()
 
-    # FileResponse sets the Content-Disposition header so that browsers
-    # present the option to save the file.
-    buffer.seek(0)
-    response = HttpResponse(buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="prescription_{prescription.id}.pdf"'
-    return response
+def metrics_view(request):
+    """
+    Exposes the per-endpoint request histograms in the Prometheus text format.
+    """
+    allowed_ips = profiling_settings()['METRICS_ALLOWED_IPS']
+    if allowed_ips is not None and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponse("Forbidden", status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # class MessageViewSet(viewsets.ModelViewSet):
@@ -215,13 +307,42 @@ def download_prescription_pdf(request, prescription_id):
 #         # Set the sender to the current user automatically
 #         serializer.save(sender=self.request.user)
 
-class HealthMetricViewSet(viewsets.ModelViewSet):
+class HealthMetricViewSet(ArchiveScrollbackMixin, viewsets.ModelViewSet):
     serializer_class = HealthMetricSerializer
     permission_classes = [IsAuthenticated] # Needs custom permissions like IsRelatedPatientOrDoctor
+    archive_kind = 'healthmetric'
+
+    def get_visible_patient_ids(self):
+        """
+        The patients whose readings the user may see, narrowed to ?patient.
+        None means every patient (staff without ?patient). Hot and archived
+        rows both go by this.
+        """
+        user = self.request.user
+        requested = self.request.query_params.get('patient')
+        if hasattr(user, 'patient'):
+            patient_ids = [user.patient.patient_id]
+        elif hasattr(user, 'doctor'):
+            if requested:
+                patient_ids = [requested] if treats_patient(user.doctor, requested) else []
+            else:
+                patient_ids = sorted(treated_patient_ids(user.doctor))
+        elif user.is_staff:
+            return [requested] if requested else None
+        else:
+            patient_ids = []
+        return [patient_id for patient_id in patient_ids if not requested or patient_id == requested]
 
     def get_queryset(self):
-        # Implement filtering logic for patients/doctors
-        return HealthMetric.objects.all() # Placeholder
+        patient_ids = self.get_visible_patient_ids()
+        if patient_ids is None:
+            return across_shards(HealthMetric.objects.all())
+        if len(patient_ids) == 1:
+            return for_patient(HealthMetric.objects.filter(patient_id=patient_ids[0]), patient_ids[0])
+        return across_shards(HealthMetric.objects.filter(patient_id__in=patient_ids))
+
+    def get_archive_keys(self):
+        return self.get_visible_patient_ids()
     
 class ConversationViewSet(viewsets.ModelViewSet):
     """
@@ -243,20 +364,29 @@ class ConversationViewSet(viewsets.ModelViewSet):
         # For now, we assume a simple creation
         serializer.save(participants=participants)
 
-class MessageListView(generics.ListCreateAPIView):
+class MessageListView(ArchiveScrollbackMixin, generics.ListCreateAPIView):
     """
     Handles messages within a specific conversation.
+    Older messages are paged with ?before=<sent_at>&limit=N, which also
+    reaches messages that have been archived.
     """
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    archive_kind = 'message'
+
+    def is_participant(self):
+        return self.request.user.conversations.filter(id=self.kwargs['conversation_id']).exists()
 
     def get_queryset(self):
         conversation_id = self.kwargs['conversation_id']
         # Ensure the user is part of this conversation before showing messages
-        if self.request.user.conversations.filter(id=conversation_id).exists():
+        if self.is_participant():
             return Message.objects.filter(conversation_id=conversation_id).order_by('sent_at')
         return Message.objects.none()
 
+    def get_archive_keys(self):
+        return [self.kwargs['conversation_id']] if self.is_participant() else []
+
     def perform_create(self, serializer):
         conversation_id = self.kwargs['conversation_id']
         conversation = Conversation.objects.get(id=conversation_id)
@@ -284,4 +414,120 @@ class PatientListViewForDoctors(generics.ListAPIView):
     """
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
-    permission_classes = [IsAuthenticated, IsDoctorUser]
\ No newline at end of file
+    permission_classes = [IsAuthenticated, IsDoctorUser]
+
+class DoctorDashboardView(APIView):
+    """
+    Today's appointments by status, pending requests, prescriptions written
+    over the last 7 days and active patients for the logged-in doctor.
+    """
+    permission_classes = [IsAuthenticated, IsDoctorUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(doctor_dashboard(request.user.doctor.doctor_id))
+
+class AccessLogPagination(CursorPagination):
+    ordering = '-accessed_at'
+    page_size = 100
+
+class AccessLogListView(generics.ListAPIView):
+    """
+    Audit report of clinical record reads between ?start= and ?end= (ISO
+    datetimes), optionally narrowed by ?user=, ?patient_id= or ?resource_type=.
+    """
+    serializer_class = AccessLogSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = AccessLogPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        start = parse_datetime(params.get('start', ''))
+        end = parse_datetime(params.get('end', ''))
+        if start is None or end is None:
+            from rest_framework.exceptions import ValidationError
+            raise ValidationError("'start' and 'end' must be ISO 8601 datetimes.")
+        return query_access_log(
+            start, end,
+            user_id=params.get('user'),
+            patient_id=params.get('patient_id'),
+            resource_type=params.get('resource_type'),
+        )
+
+class BulkExportView(APIView):
+    """
+    Streams every row of a resource as NDJSON, for analytics and migrations.
+    ?since=<ISO datetime> limits it to rows created/updated since then, and
+    ?gzip=1 compresses the stream.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, resource, *args, **kwargs):
+        if resource not in EXPORT_RESOURCES:
+            return Response({"error": f"Unknown resource '{resource}'."}, status=status.HTTP_404_NOT_FOUND)
+        since = None
+        if 'since' in request.query_params:
+            since = parse_datetime(request.query_params['since'])
+            if since is None:
+                return Response({"error": "'since' must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            if EXPORT_RESOURCES[resource][1] is None:
+                return Response({"error": f"'{resource}' can only be exported in full."}, status=status.HTTP_400_BAD_REQUEST)
+
+        record_event(request, resource, '*', '', 'export')
+        chunks = ndjson_lines(resource, since)
+        filename = f"{resource}.ndjson"
+        if request.query_params.get('gzip') in ('1', 'true'):
+            response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class AlertRuleViewSet(viewsets.ModelViewSet):
+    """
+    Threshold rules a doctor has set on their patients' health metrics.
+    """
+    serializer_class = AlertRuleSerializer
+    permission_classes = [IsAuthenticated, IsDoctorUser]
+
+    def get_queryset(self):
+        return AlertRule.objects.filter(created_by=self.request.user.doctor).select_related('patient')
+
+    def check_rule_scope(self, serializer):
+        from rest_framework.exceptions import PermissionDenied
+        # Alerts from a rule go to the patient's treating doctor, who may not be the rule's author
+        patient = serializer.validated_data.get('patient', getattr(serializer.instance, 'patient', None))
+        if patient is None:
+            if not self.request.user.is_staff:
+                raise PermissionDenied("Only staff can set rules for every patient.")
+        elif not treats_patient(self.request.user.doctor, patient.patient_id):
+            raise PermissionDenied("You can only set rules for your own patients.")
+
+    def perform_create(self, serializer):
+        self.check_rule_scope(serializer)
+        serializer.save(created_by=self.request.user.doctor)
+
+    def perform_update(self, serializer):
+        self.check_rule_scope(serializer)
+        serializer.save()
+
+class MetricAlertViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Threshold alerts sent to the logged-in doctor, unacknowledged ones unless ?all=1.
+    """
+    serializer_class = MetricAlertSerializer
+    permission_classes = [IsAuthenticated, IsDoctorUser]
+
+    def get_queryset(self):
+        queryset = MetricAlert.objects.filter(doctor=self.request.user.doctor).select_related('patient')
+        if self.action == 'list' and self.request.query_params.get('all') not in ('1', 'true'):
+            queryset = queryset.filter(acknowledged_at__isnull=True)
+        return queryset.order_by('-created_at')
+
+    @action(detail=True, methods=['post'])
+    def acknowledge(self, request, pk=None):
+        alert = self.get_object()
+        if alert.acknowledged_at is None:
+            alert.acknowledged_at = timezone.now()
+            alert.save(update_fields=['acknowledged_at'])
+        return Response(self.get_serializer(alert).data)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,8 +47,36 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    # Proxies in front of the app that append to X-Forwarded-For; throttles
+    # bucket by the address the outermost of them saw (0 = REMOTE_ADDR)
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
+    # Token bucket rates for core.throttling; a dict sets a rate per role
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'login_username': '20/hour', # Failed logins per account and address
+        'login_account': '100/hour', # Failed logins per account, from any address
+        'register': '5/hour',
+        'prescription_pdf': {'anon': '5/min', 'patient': '20/min', 'doctor': '60/min', 'user': '20/min'},
+    },
 }
+
+# Throttle state must be shared by every worker process. The file cache does
+# that on a single host; point 'throttle' at Redis/Memcached across hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'throttle',
+        # Above MAX_ENTRIES the cache drops a third of the buckets, resetting
+        # their limits, so it must hold one per client active within an hour
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+THROTTLE_CACHE_ALIAS = 'throttle'
 MIDDLEWARE = [
+    'core.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -92,6 +121,20 @@ DATABASES = {
     }
 }
 
+# SQLITE_SHARDS=N runs the project on N local SQLite files instead, to try
+# sharding out: `manage.py migrate --database=<alias>` for each of them.
+if os.environ.get('SQLITE_SHARDS'):
+    DATABASES = {
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'{alias}.sqlite3'}
+        for alias in ['default'] + [f'shard{n}' for n in range(1, int(os.environ['SQLITE_SHARDS']))]
+    }
+
+# Patient-owned records are spread over these aliases by a hash of
+# patient_id; everything else stays on 'default'. After adding an alias,
+# migrate it and run `manage.py rebalance_shards`.
+PATIENT_SHARDS = list(DATABASES)
+DATABASE_ROUTERS = ['core.sharding.PatientShardRouter']
+
 
 
 # Password validation
@@ -135,6 +178,48 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Per-endpoint timing histograms, served at /api/metrics/ for Prometheus.
+# PROFILE_REQUESTS runs cProfile on every request and keeps a .prof dump of
+# the ones slower than SLOW_REQUEST_SECONDS (expensive, leave off normally).
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+    'PROFILE_REQUESTS': False,
+    'ALLOW_PROFILE_HEADER': DEBUG,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'PROFILE_DIR': BASE_DIR / 'profiles',
+}
+
+# Reads of EMRs, prescriptions and patient profiles are buffered and written
+# to core.AccessLog in batches; SPOOL_DIR holds the crash-recovery spool.
+AUDIT_LOG = {
+    'ENABLED': True,
+    'SPOOL_DIR': BASE_DIR / 'audit_spool',
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_QUEUE': 10000,
+}
+
+# `manage.py send_appointment_reminders` messages patients from this user
+# about approved appointments starting within LEAD_TIME_HOURS.
+APPOINTMENT_REMINDERS = {
+    'SENDER_USERNAME': 'reminders',
+    'LEAD_TIME_HOURS': 24,
+    'BATCH_SIZE': 1000,
+}
+
+# `manage.py archive_cold_rows` moves Message and HealthMetric rows older than
+# OLDER_THAN_DAYS into compressed segment files under DIR.
+ARCHIVE = {
+    'DIR': BASE_DIR / 'archive',
+    'OLDER_THAN_DAYS': 180,
+    'SEGMENT_ROWS': 5000,
+}
+
+# Drugs, allergen terms and interactions screened on every new prescription.
+# Edits to the file are picked up within a few seconds, without a restart.
+DRUG_SAFETY_DATASET = BASE_DIR / 'core' / 'data' / 'drug_safety.json'
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000", # Your React app's URL
 ]
\ No newline at end of file
@@ -2,15 +2,15 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
 )
+from core.views import LoginView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('core.urls')), # Your app's URLs
 
     # Add these lines for JWT authentication
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', LoginView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
\ No newline at end of file